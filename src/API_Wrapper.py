@@ -2,14 +2,19 @@
 Python wrapper the www.myfantasyleague.com API
 """
 
+import copy
+import gzip
+import json as jsonlib
 import logging
 import pprint
-from datetime import date
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime
 import pandas as pd
 import requests
-import requests_cache
-# this function call will transparent cache new API requests, and use the cahce whenever we make a repeated call
-requests_cache.install_cache()
+from requests.adapters import HTTPAdapter
+from src.Profiler import profile_call, profile_count
 
 __all__ = ['API']
 
@@ -22,27 +27,145 @@ class API(object):
     """
     Class providing wrappers to the MFL API calls
     The leagueid parameter is the MFL league ID. The year parameter
-    defaults to the current year. The json parameter controls the result format.
+    defaults to the current year, or the year of the replayed snapshot. The json parameter controls the result format.
     If set to True (the default), JSON data is returned. Otherwise XML is returned.
     The fail_on_error parameter will cause requests.exceptions.HTTPError to be thrown
     on a failed request. Full MFL API docs are at http://www03.myfantasyleague.com/2016/export
+    The record parameter keeps every response so it can be written to a snapshot bundle with
+    save_snapshot(). The replay parameter is the path of a snapshot bundle, every call is then
+    served from the bundle and no request is made to MFL.
     NOTE: At this time this API does not support any call requiring authentication to MFL
     """
 
-    def __init__(self, leagueid=None, year=date.today().year, user_agent=None, json=True, fail_on_error=True):
+    SNAPSHOT_VERSION = 1
+    # seconds a response stays fresh in the in-process cache, by request TYPE
+    # league setup and schedules barely change, live data has to stay fresh
+    CACHE_TTL = {
+        'league': 6 * 3600,
+        'schedule': 6 * 3600,
+        'nflSchedule': 6 * 3600,
+        'allRules': 24 * 3600,
+        'rules': 6 * 3600,
+        'players': 3600,
+        'rosters': 300,
+        'freeAgents': 300,
+        'projectedScores': 300,
+        'injuries': 300,
+        'transactions': 60,
+        'playerScores': 60,
+        'weeklyResults': 60,
+        'leagueStandings': 60,
+        'liveScoring': 15,
+    }
+    DEFAULT_TTL = 60
+
+    def __init__(self, leagueid=None, year=None, user_agent=None, json=True, fail_on_error=True,
+                 record=False, replay=None):
         self.leagueid = leagueid
-        self.url = 'https://api.myfantasyleague.com/{}/export?'.format(year)
+        # the current year, or the year a replayed bundle was recorded for
+        self.year = date.today().year if year is None else year
+        self._year_given = year is not None
         self.json = json
         self._first_req = True
         self._fail_on_error = fail_on_error
         self.user_agent = user_agent
+        self._record = record
+        self._snapshot = {}
+        self._replay = None
+        if replay:
+            self.load_snapshot(replay)
+        self.url = 'https://api.myfantasyleague.com/{}/export?'.format(self.year)
+        self.max_workers = 8
+        self._init_session()
+
+    def _init_session(self):
+        """Creates the connection pool, the in-process cache and its lock"""
+        # one keep-alive connection pool shared by every call, sized for gather()
+        # responses are only cached in process, with the TTL of their endpoint, never on disk
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # in-process cache of parsed responses, key -> (expiry, response)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._parsed = {}
+        self._inflight = {}
+
+    def __getstate__(self):
+        """The session, lock and cache can not be pickled, they are rebuilt empty on load"""
+        state = self.__dict__.copy()
+        for name in ['session', '_lock', '_inflight', '_cache', '_parsed']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_session()
+
+    def _request_key(self, params):
+        """Canonical key of a request, parameters requests would not send are ignored"""
+        return jsonlib.dumps({k: str(v) for k, v in params.items() if v is not None}, sort_keys=True)
+
+    def _call_mfl(self, params, url=None):
+        """
+        Returns the response of a request as a copy the caller is free to modify,
+        see _shared_response
+        """
+        return copy.deepcopy(self._shared_response(params, url))
 
-    def _call_mfl(self, params):
+    def _shared_response(self, params, url=None):
+        """
+        Makes the request, or serves it from the replay bundle or the in-process cache.
+        The returned object is shared by the cache, the bundles and every caller and must not be modified.
+        The url parameter is used for the MFL files that are not part of the export API,
+        params then only identify the request. Concurrent identical requests share one fetch
+        """
         if self.json:
             params['JSON'] = 1
         else:
             params['JSON'] = 0
 
+        key = self._request_key(params)
+        stage = 'MFL.' + params['TYPE']
+        if self._replay is not None:
+            if key not in self._replay:
+                raise KeyError('Request {} is not in the replay snapshot'.format(key))
+            profile_count(stage, 'replayed')
+            return self._replay[key]
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                profile_count(stage, 'cache_hits')
+                return cached[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            _logger.debug('Waiting on in-flight request %s', key)
+            profile_count(stage, 'coalesced')
+            return future.result()
+
+        try:
+            profile_count(stage, 'cache_misses')
+            response = profile_call(stage, self._fetch, params, key, url)
+            ttl = self.CACHE_TTL.get(params['TYPE'], self.DEFAULT_TTL)
+            with self._lock:
+                self._cache[key] = (time.monotonic() + ttl, response)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _fetch(self, params, key, url=None):
+        """Makes the HTTP request over the pooled session and returns the parsed response"""
         if self.user_agent:
             headers = {
                 'User-Agent': self.user_agent
@@ -50,14 +173,18 @@ class API(object):
         else:
             headers = {}
 
-        _logger.debug('Making request to %s', self.url)
-        _logger.debug('Params: %s', pprint.pformat(params))
-        results = requests.get(self.url, headers=headers, params=params)
+        if url:
+            _logger.debug('Making request to %s', url)
+            results = self.session.get(url, headers=headers)
+        else:
+            _logger.debug('Making request to %s', self.url)
+            _logger.debug('Params: %s', pprint.pformat(params))
+            results = self.session.get(self.url, headers=headers, params=params)
         if self._fail_on_error:
             # will throw an exception if the status code indicates failure
             results.raise_for_status()
 
-        if self._first_req:
+        if self._first_req and not url:
             # MFL redirects the first time you hit it's API. We want to save the URL
             # so future requests don't have the overhead of being redirected
             _logger.debug('First time requesting to MFL. Setting URL after redirects')
@@ -65,10 +192,86 @@ class API(object):
             self.url = results.url[param_remover]
             self._first_req = False
 
-        if self.json:
-            return results.json()
+        if self.json or url:
+            response = results.json()
         else:
-            return results.text
+            response = results.text
+        if self._record:
+            self._snapshot[key] = response
+        return response
+
+    def _call_mfl_df(self, params, parser):
+        """
+        Returns the response of _call_mfl parsed into a DataFrame by parser.
+        The parsed frame is cached alongside the response and rebuilt only when the response is refetched
+        """
+        response = self._shared_response(params)
+        key = self._request_key(params)
+        with self._lock:
+            parsed = self._parsed.get(key)
+        if parsed is None or parsed[0] is not response:
+            parsed = (response, profile_call('MFL.' + params['TYPE'] + '.parse', parser, response))
+            with self._lock:
+                self._parsed[key] = parsed
+        # callers are free to modify the frame they get back
+        return parsed[1].copy()
+
+    def gather(self, calls):
+        """
+        Runs independent calls concurrently over the pooled session.
+        calls is a list of (method name, kwargs) pairs, results are returned in the same order
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(getattr(self, name), **kwargs) for name, kwargs in calls]
+            return [future.result() for future in futures]
+
+    def prefetch(self):
+        """
+        Fetches every endpoint a simulation needs in parallel. The rosters, league, schedule and
+        NFL schedule are independent and fetched together, then the players on those rosters.
+        Prefetched responses are served from the in-process cache by later calls
+        """
+        rosters = self.gather([('rosters', dict(df=True)),
+                               ('league', {}),
+                               ('leagueSched', {}),
+                               ('nflSchedule', {})])[0]
+        self.players(players=','.join(rosters['player_id'].to_list()))
+
+    def clear_cache(self):
+        """Drops every cached response so the next calls go to MFL again"""
+        with self._lock:
+            self._cache = {}
+            self._parsed = {}
+
+    def save_snapshot(self, path):
+        """
+        Writes every recorded response to a gzip compressed, versioned JSON bundle at path
+        """
+        bundle = {
+            'version': self.SNAPSHOT_VERSION,
+            'created': datetime.now().isoformat(),
+            'leagueid': self.leagueid,
+            'year': self.year,
+            'responses': self._snapshot,
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            jsonlib.dump(bundle, f)
+        _logger.debug('Saved %s responses to %s', len(self._snapshot), path)
+
+    def load_snapshot(self, path):
+        """
+        Switches the API to replay mode, serving every call from the bundle at path
+        """
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            bundle = jsonlib.load(f)
+        if bundle.get('version') != self.SNAPSHOT_VERSION:
+            raise ValueError('Snapshot {} has version {}, expected {}'.format(
+                path, bundle.get('version'), self.SNAPSHOT_VERSION))
+        if self.leagueid is None:
+            self.leagueid = bundle['leagueid']
+        if not self._year_given:
+            self.year = bundle['year']
+        self._replay = bundle['responses']
 
     def _check_leagueid(self):
         try:
@@ -89,13 +292,15 @@ class API(object):
         params = dict(TYPE='players', L=self.leagueid, PLAYERS=players, SINCE=since)
         if details:
             params['DETAILS'] = 1
-        response = self._call_mfl(params)
         if df:
-            response = response['players']['player']
-            if type(response) != list:
-                response = [response]
-            response = pd.DataFrame.from_dict(response)
-        return response
+            return self._call_mfl_df(params, self._parse_players)
+        return self._call_mfl(params)
+
+    def _parse_players(self, response):
+        response = response['players']['player']
+        if type(response) != list:
+            response = [response]
+        return pd.DataFrame.from_dict(response)
 
     def allRules(self):
         """
@@ -111,16 +316,18 @@ class API(object):
         """
         return self._call_mfl(dict(TYPE='injuries'))
 
-    def nflSchedule(self, weeknum='', year=date.today().year, df=False):
+    def nflSchedule(self, weeknum='', year=None, df=False):
         """
         The NFL schedule for one week of the season. The weeknum parameter defaults to the current week
         If specified, weeknum should be a number between representing the week of the NFL schedule
+        The year defaults to the API year and is then left out of the request key, so a replayed
+        bundle does not depend on the date it is replayed on
         """
-        if weeknum != '':
-            weeknum = '_'+str(weeknum)
-        url = 'https://api.myfantasyleague.com/fflnetdynamic{}/nfl_sched{}.json'.format(year, weeknum)
+        url_weeknum = '_'+str(weeknum) if weeknum != '' else ''
+        url = 'https://api.myfantasyleague.com/fflnetdynamic{}/nfl_sched{}.json'.format(
+            self.year if year is None else year, url_weeknum)
 
-        results = requests.get(url).json()
+        results = self._call_mfl(dict(TYPE='nflSchedule', W=weeknum, YEAR=year), url=url)
         if df==True:
             print('TODO')
         return results
@@ -166,10 +373,9 @@ class API(object):
         """
         self._check_leagueid()
         params = dict(TYPE='league', L=self.leagueid)
-        response = self._call_mfl(params)
         if df:
-            response = pd.DataFrame.from_dict(response['league']['franchises']['franchise'])
-        return response
+            return self._call_mfl_df(params, lambda r: pd.DataFrame.from_dict(r['league']['franchises']['franchise']))
+        return self._call_mfl(params)
 
     def rules(self):
         """League scoring rules for a given league. allRules() should be called to interpret the abbreviations"""
@@ -184,11 +390,10 @@ class API(object):
         """
         self._check_leagueid()
         params = dict(TYPE='rosters', L=self.leagueid, FRANCHISE=franchiseid)
-        response = self._call_mfl(params)
         if df:
-            response = pd.DataFrame.from_dict(response['rosters']['franchise'])
-            response = self.explode_list_dict_col(response, 'player', 'id')
-        return response
+            return self._call_mfl_df(params, lambda r: self.explode_list_dict_col(
+                pd.DataFrame.from_dict(r['rosters']['franchise']), 'player', 'id'))
+        return self._call_mfl(params)
 
     def leagueStandings(self):
         """The current league standings for a given league"""
@@ -226,10 +431,9 @@ class API(object):
         self._check_leagueid()
         params = dict(TYPE='playerScores', W=weeknum, L=self.leagueid)
         params.update(kwargs)
-        response = self._call_mfl(params)
         if df:
-            response = pd.DataFrame.from_dict(response['playerScores']['playerScore'])
-        return response
+            return self._call_mfl_df(params, lambda r: pd.DataFrame.from_dict(r['playerScores']['playerScore']))
+        return self._call_mfl(params)
 
     def draftResults(self):
         """Draft results for a given league"""
@@ -249,15 +453,28 @@ class API(object):
         params = dict(TYPE='auctionResults', L=self.leagueid)
         return self._call_mfl(params)
 
-    def freeAgents(self, position=None):
+    def freeAgents(self, position=None, df=False):
         """
         Fantasy free agents for the league. If position is specified
         only results for that position will be shown
         """
         self._check_leagueid()
         params = dict(TYPE='freeAgents', L=self.leagueid, POSITION=position)
+        if df:
+            return self._call_mfl_df(params, self._parse_free_agents)
         return self._call_mfl(params)
 
+    def _parse_free_agents(self, response):
+        units = response['freeAgents']['leagueUnit']
+        if type(units) != list:
+            units = [units]
+        players = []
+        for unit in units:
+            unit_players = unit.get('player', [])
+            players += unit_players if type(unit_players) == list else [unit_players]
+        df = pd.DataFrame.from_dict(players, dtype=object).reindex(columns=['id', 'status'])
+        return df.rename(columns={'id': 'player_id', 'status': 'player_status'})
+
     def transactions(self, trans_type=None, count=None, franchise=None, days=None):
         """
         Transactions for the league. The optional arguments allow for limiting the results
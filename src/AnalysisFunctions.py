@@ -11,8 +11,10 @@ class AnalysisFunctions:
     def gb_report(self, df, cols, by, plot_label, order_by=None, is_time_delta=True, show_graphs=True):
         '''
         Performs a groupby on df by "by" and returns a set of metrics on each col in cols
+        df is only copied when the time delta conversion has to modify it, so memory mapped frames stay on disk
         '''
-        df = df.copy()
+        if is_time_delta:
+            df = df.copy()
         for col in cols:
             # Generate Tables
             print(col)
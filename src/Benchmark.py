@@ -0,0 +1,216 @@
+'''
+Times every stage of the simulation pipeline on synthetic leagues, no MFL access or data files needed
+python -m src.Benchmark --n 10 100 1000 10000 100000 --out outputs/benchmark.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.Data_Generator import SAMPLING_SCHEMES
+from src.Profiler import Profiler
+from src.Reporter import Reporter
+from src.Simulator import Simulator
+from src.Synthetic_League import Synthetic_League, Synthetic_Data_Generator
+
+
+class Benchmark():
+    '''
+    Runs the full pipeline, Data_Generator then every Simulator output, on one synthetic league
+    for each replication count in ns and records the Profiler stats of each stage
+    replication counts above batch_size run in streaming mode so memory stays bounded
+    memory turns on peak memory tracking, trace_path writes one trace per replication count
+    '''
+
+    def __init__(self, ns=(10, 100, 1000, 10000, 100000), franchises=12, roster_size=16, week=1, seed=0,
+                 repeat=1, batch_size=10000, memory=False, trace_path=None):
+        self.ns = list(ns)
+        self.week = week
+        self.seed = seed
+        self.repeat = repeat
+        self.batch_size = batch_size
+        self.memory = memory
+        self.trace_path = trace_path
+        self.league = Synthetic_League(franchises=franchises, roster_size=roster_size, week=week, seed=seed)
+
+    def run(self):
+        '''
+        returns the benchmark report, one result per replication count
+        the fastest of the repeat runs of each stage is kept
+        '''
+        with tempfile.TemporaryDirectory() as tmp:
+            api = self.league.api(os.path.join(tmp, 'synthetic_league.json.gz'))
+            results = []
+            for n in self.ns:
+                runs = [self.run_once(api, n) for _ in range(self.repeat)]
+                result = runs[0]
+                for run in runs[1:]:
+                    result['total_seconds'] = min(result['total_seconds'], run['total_seconds'])
+                    for name, stage in run['stages'].items():
+                        for key in ['wall_s', 'self_wall_s', 'cpu_s']:
+                            result['stages'][name][key] = min(result['stages'][name][key], stage[key])
+                results.append(result)
+                print('n=' + str(n) + ' ' + result['engine'] + ' ' + '{:.3f}'.format(result['total_seconds']) + 's')
+        return {'created': datetime.now().isoformat(),
+                'environment': self.environment(),
+                'league': {'franchises': self.league.franchises,
+                           'roster_size': self.league.roster_size,
+                           'week': self.week,
+                           'seed': self.seed},
+                'repeat': self.repeat,
+                'batch_size': self.batch_size,
+                'results': results}
+
+    def run_once(self, api, n):
+        '''
+        times one pass of the pipeline with n replications
+        '''
+        stream = n > self.batch_size
+        trace_path = None
+        if self.trace_path:
+            trace_path = os.path.splitext(self.trace_path)[0] + '_' + str(n) + '.json'
+        with Profiler(memory=self.memory, trace_path=trace_path) as profiler:
+            start = time.perf_counter()
+            rep = Reporter(api, self.week)
+            dg = Synthetic_Data_Generator(self.league, self.week, api, rep, n, seed=self.seed)
+            sim = Simulator(self.week, api, rep, dg, n, batch_size=self.batch_size if stream else None)
+            if not stream:
+                sim.matchup_df
+                sim.rank_df
+            sim.team_df
+            sim.outcome_df
+            total = time.perf_counter() - start
+        return {'n': n,
+                'engine': 'stream' if stream else 'materialized',
+                'total_seconds': total,
+                'score_df_rows': len(dg.score_df),
+                'drawn_rows': len(dg.draw_rows),
+                'stages': profiler.stats}
+
+    def compare_sampling(self, n=1024, replicates=20, schemes=SAMPLING_SCHEMES):
+        '''
+        estimates the standard error of outcome_df.made_playoffs under each sampling scheme from the spread
+        of replicates independent simulations of n runs, returns one row per scheme with the variance
+        reduction against mc and the runs the scheme needs to match the mc standard error at n
+        '''
+        made_playoffs = {}
+        seconds = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            api = self.league.api(os.path.join(tmp, 'synthetic_league.json.gz'))
+            rep = Reporter(api, self.week)
+            for scheme in schemes:
+                start = time.perf_counter()
+                runs = []
+                for replicate in range(replicates):
+                    dg = Synthetic_Data_Generator(self.league, self.week, api, rep, n, seed=self.seed + replicate,
+                                                  sampling=scheme)
+                    runs.append(Simulator(self.week, api, rep, dg, n).outcome_df.made_playoffs.to_numpy())
+                made_playoffs[scheme] = np.array(runs)
+                seconds[scheme] = time.perf_counter() - start
+                print(scheme + ' ' + '{:.3f}'.format(seconds[scheme]) + 's')
+        mc_var = made_playoffs['mc'].var(axis=0, ddof=1) if 'mc' in made_playoffs else None
+        rows = []
+        for scheme, runs in made_playoffs.items():
+            se = runs.std(axis=0, ddof=1)
+            row = {'scheme': scheme,
+                   'n': n,
+                   'replicates': replicates,
+                   'mean_se': float(se.mean()),
+                   'max_se': float(se.max()),
+                   'seconds_per_run': seconds[scheme] / (n * replicates)}
+            if mc_var is not None:
+                # Franchises certain to make or miss the playoffs have no variance under any scheme
+                # the ratio of summed variances, a mean of per franchise ratios of noisy estimates overstates it
+                uncertain = (mc_var > 0) & (se > 0)
+                reduction = float(mc_var[uncertain].sum() / (se[uncertain] ** 2).sum()) if uncertain.any() else 1.0
+                row['variance_reduction'] = reduction
+                row['runs_for_mc_se'] = n / reduction
+            rows.append(row)
+        return rows
+
+    def environment(self):
+        '''
+        returns the versions and machine the benchmark ran on
+        '''
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            commit = None
+        return {'commit': commit or None,
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'cpus': os.cpu_count()}
+
+    def stage_table(self, report):
+        '''
+        returns a (n, stage) table of the self time of every stage in a report
+        '''
+        rows = [{'n': result['n'], 'stage': name, 'seconds': stage['self_wall_s']}
+                for result in report['results'] for name, stage in result['stages'].items()]
+        rows += [{'n': result['n'], 'stage': 'total', 'seconds': result['total_seconds']}
+                 for result in report['results']]
+        return pd.DataFrame(rows).pivot(index='stage', columns='n', values='seconds')
+
+    def compare(self, report, baseline):
+        '''
+        returns the ratio of the stage times of report over the stage times of a baseline report
+        values above 1 are slower than the baseline
+        '''
+        return self.stage_table(report) / self.stage_table(baseline)
+
+    def save(self, report, path):
+        '''
+        writes a report to a JSON file
+        '''
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the simulation pipeline on a synthetic league')
+    parser.add_argument('--n', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--franchises', type=int, default=12)
+    parser.add_argument('--roster-size', type=int, default=16)
+    parser.add_argument('--week', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--memory', action='store_true', help='track the peak memory of each stage')
+    parser.add_argument('--trace', help='write a chrome trace of each run, suffixed with n')
+    parser.add_argument('--out', default='outputs/benchmark.json')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--sampling', action='store_true',
+                        help='compare the standard error of made_playoffs under every sampling scheme')
+    parser.add_argument('--sampling-n', type=int, default=1024)
+    parser.add_argument('--replicates', type=int, default=20)
+    args = parser.parse_args()
+    bench = Benchmark(args.n, args.franchises, args.roster_size, args.week, args.seed, args.repeat, args.batch_size,
+                      args.memory, args.trace)
+    report = bench.run()
+    if args.sampling:
+        report['sampling'] = bench.compare_sampling(args.sampling_n, args.replicates)
+    bench.save(report, args.out)
+    with pd.option_context('display.float_format', '{:,.4f}'.format, 'display.width', 200):
+        print(bench.stage_table(report))
+        if args.compare:
+            with open(args.compare) as f:
+                print(bench.compare(report, json.load(f)))
+        if args.sampling:
+            print(pd.DataFrame(report['sampling']).set_index('scheme'))
+
+
+if __name__ == '__main__':
+    main()
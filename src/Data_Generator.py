@@ -3,19 +3,79 @@ import numpy as np
 import re
 from itertools import product
 from math import sqrt
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 from src.AnalysisFunctions import AnalysisFunctions
+from src.Input_Cache import Input_Cache
+from src.Player_Index import Player_Index
+from src.Profiler import profiled
+
+_NON_ALPHA = re.compile('[^a-z]')
+SAMPLING_SCHEMES = ['mc', 'antithetic', 'sobol', 'stratified']
+
+
+def _standard_normals(rng, sampling, n, n_games, n_slots, n_bench):
+    '''
+    returns the (games x n x slots) game and (bench x n) bench standard normals of n replications
+    'mc' draws them independently, 'antithetic' pairs every replication with its mirror image,
+    'sobol' maps a scrambled Sobol sequence and 'stratified' a latin hypercube through the normal
+    inverse cdf, both need scipy and stratify every normal of a replication across the n replications
+    '''
+    if sampling == 'mc':
+        return rng.standard_normal((n_games, n, n_slots)), rng.standard_normal((n_bench, n))
+    if sampling == 'antithetic':
+        z, bench_z = _standard_normals(rng, 'mc', (n + 1) // 2, n_games, n_slots, n_bench)
+        return np.concatenate([z, -z], axis=1)[:, :n], np.concatenate([bench_z, -bench_z], axis=1)[:, :n]
+    if sampling not in SAMPLING_SCHEMES:
+        raise ValueError('sampling must be one of ' + ', '.join(SAMPLING_SCHEMES))
+    try:
+        from scipy.stats import qmc
+        from scipy.special import ndtri
+    except ImportError:
+        raise ImportError(sampling + ' sampling needs scipy, install it or use mc or antithetic sampling')
+    n_dims = n_games * n_slots + n_bench
+    if n == 0 or n_dims == 0:
+        return np.zeros((n_games, n, n_slots)), np.zeros((n_bench, n))
+    if sampling == 'sobol':
+        # balanced for a power of 2 replications, scipy warns otherwise
+        engine = qmc.Sobol(n_dims, scramble=True, seed=rng)
+    else:
+        engine = qmc.LatinHypercube(n_dims, seed=rng)
+    u = engine.random(n)
+    z = ndtri(np.clip(u, 1e-12, 1 - 1e-12))
+    game_z = z[:, :n_games * n_slots].reshape(n, n_games, n_slots).transpose(1, 0, 2)
+    return game_z, z[:, n_games * n_slots:].T
+
+
+def _draw_shard(sampler, n, seed_seq):
+    '''
+    draws n simulations of every game, then of every bench player, from the shard's own generator
+    returns a (drawn rows x n) float32 array, module level so it can run in a process pool
+    '''
+    rng = np.random.default_rng(seed_seq)
+    means = sampler['means']
+    z, bench_z = _standard_normals(rng, sampler['sampling'], n, means.shape[0], means.shape[1],
+                                   len(sampler['bench_means']))
+    score_mat = means[:, np.newaxis, :] + z @ sampler['cov_factor']
+    bench_mat = sampler['bench_means'][:, np.newaxis] + sampler['bench_sd'][:, np.newaxis] * bench_z
+    return np.concatenate([score_mat[sampler['game_idx'], :, sampler['slot_idx']], bench_mat]).astype(np.float32)
+
 
 class Data_Generator():
     '''
     This class generates the basic data structures needed to execute the simulation
     '''
 
-    def __init__(self, week, api, rep , n=10):
-        np.random.seed(0)
+    def __init__(self, week, api, rep , n=10, seed=0, shards=1, workers=1, cache_dir='data/cache',
+                 index_path='data/player_index.json', sampling='mc', free_agents=False):
         self.week = week
         self.api = api
         self.rep = rep
         self.af = AnalysisFunctions('')
+        # Parsed projection, defense and correlation files are cached, pass cache_dir=None to always parse
+        self.input_cache = Input_Cache(cache_dir) if cache_dir else None
+        # MFL player id -> projection key, saved between runs
+        self.player_index = Player_Index(index_path)
         self.pos_list = ['QB', 'RB', 'WR', 'TE']
         self.team_id_dict = team_id_dict = {'Arizona Cardinals': 'ARI',
                                             'Atlanta Falcons': 'ATL',
@@ -51,21 +111,58 @@ class Data_Generator():
                                             'Washington Football Team': 'WAS',
                                             'BYE': 'BYE'
                                             }
-        # self.week_proj_dict = self.read_weekly_projections()
-        self.plr_proj_dict = self.create_plr_proj_dict()
+        self.proj_files = ['data/Season Projections/20210915/FantasyPros_2021_Ros_' + pos + '_Rankings.csv'
+                           for pos in self.pos_list]
+        self.def_files = ['data/Defensive Performance/2020/sportsref_download_' + pos + '.xlsx'
+                          for pos in self.pos_list]
+        self.corr_file = 'data/Position_Correlations.xlsx'
+        self.plr_proj_dict = self.load_input('plr_proj_dict', self.proj_files, self.create_plr_proj_dict)
         self.sched_dict = self.create_sched_dict()
-        self.pos_opp_dict = self.create_pos_opp_dict()
+        self.pos_opp_dict = self.load_input('pos_opp_dict', self.def_files, self.create_pos_opp_dict)
+        self.opp_idx, self.opp_factor = self.create_opp_tensor()
         self.n = n
+        # Replications are split into shards, each drawn from its own SeedSequence stream
+        # results only depend on seed and shards, never on the number of workers
+        self.seed = seed
+        self.shards = shards
+        self.workers = workers
+        # Variance reduction scheme of the player score draws, one of SAMPLING_SCHEMES
+        if sampling not in SAMPLING_SCHEMES:
+            raise ValueError('sampling must be one of ' + ', '.join(SAMPLING_SCHEMES))
+        self.sampling = sampling
+        # Also simulate the projected free agents, without a franchise, for Simulator.rank_free_agents
+        self.free_agents = free_agents
         self.mean_order = ['QB1', 'RB1', 'RB2', 'WR1', 'WR2', 'WR3', 'TE1']
         self.vars_by_pos = [11, 8, 7, 10, 8.5, 8, 7]
         self.vars_df = pd.DataFrame(self.vars_by_pos).T
         self.vars_df.columns = self.mean_order # TODO: make less ugly
-        self.corr_df = pd.read_excel('data/Position_correlations.xlsx', sheet_name='RAW', index_col=0)
+        self.corr_df = self.load_input('corr_df', [self.corr_file], self.read_corr_df)
         self.corr_mat = self.corr_df.to_numpy()
         self.cov_mat = self.create_cov_mat()
+        self.cov_factor = self.factor_cov_mat()
         self.score_df = self.create_score_df()
+        # Final points of the current week's players fixed by condition_week, by score_df row
+        self.live_obs = pd.Series(dtype=float)
+        self.live_draws = 0
         
 
+    @profiled
+    def load_input(self, name, sources, builder):
+        '''
+        returns builder() through the compiled input cache when it is enabled
+        '''
+        if self.input_cache is None:
+            return builder()
+        return self.input_cache.load(name, sources, builder)
+
+    @profiled
+    def read_corr_df(self):
+        '''
+        reads the position correlation matrix
+        '''
+        return pd.read_excel(self.corr_file, sheet_name='RAW', index_col=0)
+
+    @profiled
     def create_plr_proj_dict(self):
         '''
         generates the player mean score dictionary
@@ -73,7 +170,7 @@ class Data_Generator():
         '''
         df_list = [None]*len(self.pos_list)
         for i, pos in enumerate(self.pos_list):
-            df = pd.read_csv('data/Season Projections/20210915/FantasyPros_2021_Ros_' + pos + '_Rankings.csv')
+            df = pd.read_csv(self.proj_files[i])
             # TODO Print last modified date
             df.rename(columns={'PROJ. FPTS': 'FPTS',
                                 'PLAYER NAME': 'Player'}, inplace=True)
@@ -91,6 +188,7 @@ class Data_Generator():
         # assert plr_proj_dict['zachwilson'] == 246.2
         return plr_proj_dict
 
+    @profiled
     def create_sched_dict(self):
         '''
         generates a dicitonary providing a week, team and opponent
@@ -109,6 +207,7 @@ class Data_Generator():
                                                        for match in match_list}}
         return sched_dict
 
+    @profiled
     def create_pos_opp_dict(self):
         '''
         generates the opponent-postion normalized dictionary
@@ -116,7 +215,7 @@ class Data_Generator():
         '''
         df_list = [None]*len(self.pos_list)
         for i, pos in enumerate(self.pos_list):
-            df = pd.read_excel('data/Defensive Performance/2020/sportsref_download_' + pos + '.xlsx')
+            df = pd.read_excel(self.def_files[i])
             # TODO Print last modified date
             df.rename(columns={'Unnamed: 0': 'Team',
                                'Fantasy per Game': 'PPG'},
@@ -139,85 +238,142 @@ class Data_Generator():
             'Position dict generation, Jets defense estimated to be ' + str(pos_opp_dict['QB']['NYJ']['PPG'])
         return pos_opp_dict
 
-    def read_sched_dict(self, x):
-        '''
-        reads the schedule dictionary for populating roster dataframe with matchups
-        '''
-        try:
-            return self.sched_dict[x['week']-1][x['team']]
-        except:
-            return 'BYE'
-
-    def mean_pts(self, x):
-        '''
-        returns the mean points expected for a player on a given week
-        used in apply function x is row of dataframe
-        '''
-        try:
-            return self.plr_proj_dict[x['norm_name_player']]/x['weeks_remaining'] *\
-                    self.pos_opp_dict[x['position']][x['opp']]['PPG']
-        except:
-            return 0
+    @profiled
+    def create_opp_tensor(self):
+        '''
+        precomputes the schedule and opponent factors as dense arrays indexed by nfl_teams
+        opp_idx[team, week] is the opponent of a team, the last team is the BYE sentinel
+        opp_factor[position, opp] is the opponent-position normalized points factor, 0 on a bye
+        or for a position without defensive data (last row)
+        '''
+        teams = {team for week_dict in self.sched_dict.values() for team in week_dict}
+        teams |= {team for pos_dict in self.pos_opp_dict.values() for team in pos_dict if isinstance(team, str)}
+        self.nfl_teams = sorted(teams - {'BYE'}) + ['BYE']
+        self.nfl_team_idx = {team: i for i, team in enumerate(self.nfl_teams)}
+        bye = self.nfl_team_idx['BYE']
+        opp_idx = np.full((len(self.nfl_teams), len(self.sched_dict) + 1), bye)
+        for week, week_dict in self.sched_dict.items():
+            for team, opp in week_dict.items():
+                opp_idx[self.nfl_team_idx[team], week + 1] = self.nfl_team_idx[opp]
+        opp_factor = np.zeros((len(self.pos_list) + 1, len(self.nfl_teams)))
+        for i, pos in enumerate(self.pos_list):
+            for team, factor in self.pos_opp_dict[pos].items():
+                if team in self.nfl_team_idx:
+                    opp_factor[i, self.nfl_team_idx[team]] = factor['PPG']
+        opp_factor[:, bye] = 0
+        return opp_idx, opp_factor
 
+    @profiled
     def create_score_df(self):
         '''
         returns the mean scores for each player in the BDFL
         '''
         roster_df = self.rep.roster_report()
         roster_df = self.trade_simulator(roster_df)
+        # Join projections on the persistent player id index
+        self.player_index.update(roster_df)
+        roster_df['norm_name_player'] = self.player_index.lookup(roster_df.player_id)
+        self.miss_df = self.player_index.miss_report(roster_df, self.plr_proj_dict, self.pos_list)
+        if len(self.miss_df) > 0:
+            print('*** NO PROJECTION FOR ' + str(len(self.miss_df)) + ' PLAYERS, SEE miss_df ***')
+        if self.free_agents:
+            fa_df = self.free_agent_df()
+            roster_df = pd.concat([roster_df, fa_df[~fa_df.player_id.isin(roster_df.player_id)]], ignore_index=True)
+        roster_df.name_player = roster_df.name_player.str.split(', ').str[::-1].str.join(' ')
         # Repeat dataframe rows and add week numbers remaining
         roster_df = pd.DataFrame(np.repeat(roster_df.values, 19-self.week, axis=0), columns=roster_df.columns)
         roster_df['week'] = list(range(self.week, 19)) * len(roster_df.drop_duplicates('player_id'))
-        roster_df['opp'] = roster_df.apply(lambda x: self.read_sched_dict(x), axis=1)
         roster_df['weeks_remaining'] = roster_df.week.max() - self.week + 1
-        roster_df.name_player = roster_df.name_player.str.split(', ').map(lambda x: ' '.join(x[::-1]))
-        # Create normalized player name id
-        roster_df['norm_name_player'] = roster_df.name_player.apply(self.normalize_name)
-        # Add mean points
-        roster_df['mean_pts'] = roster_df.apply(lambda x: self.mean_pts(x), axis=1)
-        # Overwrite mean points for current week
-        # roster_df.loc[roster_df.week == self.week, 'mean_pts'] = roster_df.norm_name_player.map(self.week_proj_dict).fillna(0)
+        # Opponents and mean points are integer indexed lookups into the dense schedule tensors
+        team = roster_df.team.map(self.nfl_team_idx).fillna(self.nfl_team_idx['BYE']).to_numpy(dtype=int)
+        opp = self.opp_idx[team, roster_df.week.to_numpy(dtype=int)]
+        roster_df['opp'] = np.array(self.nfl_teams, dtype=object)[opp]
+        pos = roster_df.position.map({pos: i for i, pos in enumerate(self.pos_list)})\
+            .fillna(len(self.pos_list)).to_numpy(dtype=int)
+        proj = pd.to_numeric(roster_df.norm_name_player.map(self.plr_proj_dict), errors='coerce').fillna(0)
+        roster_df['mean_pts'] = proj.to_numpy(dtype=float) / roster_df.weeks_remaining.to_numpy(dtype=float) * \
+            self.opp_factor[pos, opp]
+        # Weekly projections of the current week are overlaid afterwards by apply_weekly_projections
         roster_df = self.add_position_rank(roster_df)
         # Choose BDFL starters
         roster_df = self.pick_starters(roster_df)
         # Simulate NFL games
+        roster_df = roster_df.reset_index(drop=True)
         roster_df = self.add_random_pts(roster_df)
         return roster_df
 
-    def gen_rand_pts(self, means):
+    @profiled
+    def free_agent_df(self):
         '''
-        takes in an array of means scores for each player and outputs a 2d array of n simulations of the game
+        returns the free agents at a projected position that have a projection, in the roster_report format
+        they are drawn with the rostered players so the NFL depth charts include them
         '''
-        # TODO: Anything that comes in as a 0 should leave as a 0
-        # TODO: SIZE DOESN'T DO WHAT YOU THINK IT DOES
-        data = np.random.multivariate_normal(means, self.cov_mat, size=self.n)
-        return data
+        fa_df = self.rep.free_agent_report()
+        fa_df = fa_df[fa_df.position.isin(self.pos_list)]
+        self.player_index.update(fa_df)
+        fa_df['norm_name_player'] = self.player_index.lookup(fa_df.player_id)
+        return fa_df[fa_df.norm_name_player.isin(set(self.plr_proj_dict))]
 
-    def normalize_name(self, name):
+    @profiled
+    def gen_rand_pts(self, sampler=None, stream=()):
         '''
-        Accepts a name string, removes all non alphabetic characters and sets to lower
+        outputs a (drawn rows x n) array of n simulations of every game, drawn in batches with the
+        cached covariance factor, followed by the independent draws of the bench players
+        the n replications are split into shards that are drawn in a process pool when workers > 1
+        sampler defaults to the sampler of score_df, stream selects the seed streams, see shard_seed
         '''
-        name = ''.join(name.lower().split()[0:2])
-        regex = re.compile('[^a-z]')
-        name = regex.sub('', name)
-        return name
+        # TODO: Anything that comes in as a 0 should leave as a 0
+        sampler = self.sampler if sampler is None else sampler
+        shard_sizes = [len(shard) for shard in np.array_split(np.arange(self.n), self.shards)]
+        shard_args = [(sampler, size, self.shard_seed(i, *stream)) for i, size in enumerate(shard_sizes)]
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                # map returns in shard order so the merge is deterministic
+                shard_list = list(pool.map(_draw_shard, *zip(*shard_args)))
+        else:
+            shard_list = [_draw_shard(*args) for args in shard_args]
+        return np.concatenate(shard_list, axis=1)
 
-    def clean_mean_list(self, ls):
+    def shard_seed(self, shard, *stream):
         '''
-        encapsulates each item of list in a list
+        returns the independent SeedSequence stream of a shard, the same child spawn() would create
+        stream keys give further independent streams of the shard, such as the redraw of a week
         '''
-        return [item[0] if len(item) > 0 else 0 for item in ls]
+        return np.random.SeedSequence(self.seed, spawn_key=(shard,) + stream)
 
-    def find_game_means(self, df, week, team, opp_team):
+    def normalize_name(self, name):
         '''
-        returns the mean performance of each player in the relevant position ranks
-        returns in the correct order for the position matrix 'mean_order'
+        Accepts a name string, removes all non alphabetic characters and sets to lower
         '''
-        team_mean_list = [df[(df.week == week) & (df.team == team) & (df.pos_rank == pos_rank)].mean_pts.values *0.7 for pos_rank in self.mean_order]
-        opp_mean_list = [df[(df.week == week) & (df.team == opp_team) & (df.pos_rank == pos_rank)].mean_pts.values *0.7 for pos_rank in self.mean_order]
-        means = team_mean_list + opp_mean_list
-        return self.clean_mean_list(means)
+        name = ''.join(name.lower().split()[0:2])
+        return _NON_ALPHA.sub('', name)
+
+    @profiled
+    def create_game_table(self, df):
+        '''
+        returns a (games x positions) array of the score_df row index of the player filling each
+        slot of the position matrix 'mean_order' for both teams of every NFL game, -1 if the slot is empty
+        '''
+        # (week, team, pos_rank) -> row index, first player listed wins ties
+        slot_df = df[['week', 'team', 'pos_rank']].drop_duplicates()
+        slot_index = pd.Series(slot_df.index, index=pd.MultiIndex.from_frame(slot_df))
+        # one entry per NFL game, no games for teams on bye or without an NFL team
+        games = df.loc[~df.team.isin(['FA', 'FA*', 'BYE']) & (df.opp != 'BYE'), ['week', 'team', 'opp']]
+        games = games.drop_duplicates()
+        home = games[['team', 'opp']].min(axis=1)
+        away = games[['team', 'opp']].max(axis=1)
+        games = pd.DataFrame({'week': games.week.to_numpy(), 'team': home.to_numpy(), 'opp': away.to_numpy()})
+        games = games.drop_duplicates().reset_index(drop=True)
+        self.game_df = games
+        keys = [(week, side, pos_rank)
+                for week, team, opp in games.itertuples(index=False)
+                for side, pos_rank in product([team, opp], self.mean_order)]
+        if len(keys) == 0:
+            return np.empty((0, len(self.mean_order) * 2), dtype=int)
+        rows = slot_index.reindex(pd.MultiIndex.from_tuples(keys)).fillna(-1).to_numpy().astype(int)
+        return rows.reshape(len(games), len(self.mean_order) * 2)
 
+    @profiled
     def add_position_rank(self, df):
         '''
         determines how the player rates against other players of their same position on their
@@ -227,42 +383,162 @@ class Data_Generator():
         df['pos_rank'] = df.position + df.pos_rank.astype(str)
         return df
 
+    @profiled
     def add_random_pts(self, df):
         '''
         facilitates the execution of the simulation of n NFL games for players on BDFL rosters
         correlations between player performances and mean expectations are taken into account
+        draws are stored in the contiguous float32 matrix pts_mat, one row per score_df row
         '''
-        df['pts'] = ''
-        for week in range(df.week.min(), df.week.max()+1):
-            teams_observed = ['FA', 'FA*', 'BYE']
-            for team in df[df.week == week].team.unique():
-                if team not in teams_observed:
-                    opp_team = df[(df.week == week) & (df.team == team)].opp.iloc[0]
-                    means = self.find_game_means(df, week, team, opp_team)
-                    teams_observed += [opp_team]
-                    score_mat = self.gen_rand_pts(means)
-                    for i, pos_rank in enumerate(self.mean_order):
-                        team_player = df[(df.week == week) & (df.team == team) & (df.pos_rank == pos_rank)]
-                        opp_player = df[(df.week == week) & (df.team == opp_team) & (df.pos_rank == pos_rank)]
-                        if len(team_player) > 0:
-                            team_idx = team_player.index[0]
-                            df.at[team_idx, 'pts'] = score_mat[:, i]
-                        if len(opp_player) > 0:
-                            opp_idx = opp_player.index[0]
-                            df.at[opp_idx, 'pts'] = score_mat[:, i]
+        self.sampler, self.draw_rows, self.game_rows = self.create_sampler(df)
+        # Draws of pts_mat in order, (rows cleared first, sampler, drawn rows, seed stream), replayed on first use
+        self.draw_plan = [(None, self.sampler, self.draw_rows, ())]
+        self.pts_row = pd.Series(np.arange(len(df)), index=pd.MultiIndex.from_frame(df[['player_id', 'week']]))
         return df
 
+    @cached_property
+    def pts_mat(self):
+        '''
+        the (score_df rows x n) float32 matrix of player draws, drawn on first use
+        a Data_Generator only streamed by Simulator with batch_size never holds the n runs
+        '''
+        # Players that are not drawn (no game, no projection) score 0
+        pts_mat = np.zeros((len(self.pts_row), self.n), dtype=np.float32)
+        for clear, sampler, draw_rows, stream in self.draw_plan:
+            self.draw_into(pts_mat, clear, sampler, draw_rows, stream)
+        return pts_mat
+
+    def draw_into(self, pts_mat, clear, sampler, draw_rows, stream):
+        '''
+        zeroes the rows clear of pts_mat then fills draw_rows with the draws of sampler from the stream seeds
+        '''
+        if clear is not None:
+            pts_mat[clear] = 0
+        pts_mat[draw_rows] = self.gen_rand_pts(sampler, stream)
+
+    def create_sampler(self, df):
+        '''
+        returns the sampler drawing the players of df, the score_df row of each drawn row and the game table
+        df can be any subset of score_df rows, rows are identified by their score_df index
+        '''
+        game_rows = self.create_game_table(df)
+        filled = game_rows >= 0
+        means = df.mean_pts.reindex(game_rows.ravel()).fillna(0).to_numpy(dtype=float).reshape(game_rows.shape) * 0.7
+        game_idx, slot_idx = np.nonzero(filled)
+        # Depth players outside the position matrix are drawn independently
+        # with the variance of the deepest slot of their position
+        bench_var = {pos_rank[:2]: var for pos_rank, var in zip(self.mean_order, self.vars_by_pos)}
+        bench = ~df.index.isin(game_rows[filled]) & (df.mean_pts > 0) & df.position.isin(self.pos_list)
+        sampler = {'means': means,
+                   'cov_factor': self.cov_factor,
+                   'game_idx': game_idx,
+                   'slot_idx': slot_idx,
+                   'bench_means': df.loc[bench, 'mean_pts'].to_numpy(dtype=float) * 0.7,
+                   'bench_sd': np.sqrt(df.loc[bench, 'position'].map(bench_var).to_numpy(dtype=float)),
+                   'sampling': self.sampling}
+        draw_rows = np.concatenate([game_rows[filled], df.index[bench].to_numpy(dtype=int)])
+        return sampler, draw_rows, game_rows
+
+    @profiled
+    def apply_weekly_projections(self, week_proj_dict=None):
+        '''
+        overwrites the mean points of the current week with the weekly projections, read_weekly_projections
+        by default, then ranks, picks the starters of and redraws that week only
+        the draws of every other week are kept, see Simulator.update_week
+        '''
+        self.week_proj_dict = self.read_weekly_projections() if week_proj_dict is None else week_proj_dict
+        df = self.score_df
+        in_week = (df.week == self.week).to_numpy()
+        week_df = df[in_week].drop(columns=['flex_rank'])
+        week_df['mean_pts'] = pd.to_numeric(week_df.norm_name_player.map(self.week_proj_dict),
+                                            errors='coerce').fillna(0)
+        week_df = self.pick_starters(self.add_position_rank(week_df))
+        df.loc[in_week, week_df.columns] = week_df
+        # The week is drawn from its own seed streams, independent of the season draws
+        week_sampler, week_draw_rows, _ = self.create_sampler(week_df)
+        step = (in_week, week_sampler, week_draw_rows, (self.week,))
+        self.draw_plan.append(step)
+        if 'pts_mat' in self.__dict__:
+            self.draw_into(self.pts_mat, *step)
+        # Streamed batches draw every week from the updated sampler
+        self.sampler, self.draw_rows, self.game_rows = self.create_sampler(df)
+        return week_df
+
+    @profiled
+    def condition_week(self, observed):
+        '''
+        fixes the current week's draws of the players whose final points are known, observed maps a player id
+        to their points, the other players of the same NFL games are redrawn from the Gaussian conditional
+        on them under the effective covariance of the draws, cov_factor.T @ cov_factor
+        only the games and players whose observations changed since the last call are redrawn
+        returns the score_df rows whose draws changed
+        '''
+        observed = pd.Series(observed, dtype=float)
+        rows = self.pts_row.reindex(pd.MultiIndex.from_arrays([observed.index, np.full(len(observed), self.week)]))
+        obs = pd.Series(observed.to_numpy(), index=rows.to_numpy())[rows.notna().to_numpy()]
+        obs.index = obs.index.astype(int)
+        union = obs.index.union(self.live_obs.index)
+        changed = union[obs.reindex(union).ne(self.live_obs.reindex(union)).to_numpy()].to_numpy(dtype=int)
+        self.live_obs = obs
+        if len(changed) == 0:
+            return changed
+        # Unobserved players that are not redrawn below have no game or projection and score 0
+        self.pts_mat[changed] = obs.reindex(changed).fillna(0).to_numpy()[:, np.newaxis]
+        # Every update draws from a new stream of the week
+        self.live_draws += 1
+        rng = np.random.default_rng(self.shard_seed(0, self.week, self.live_draws))
+        cov = self.cov_factor.T @ self.cov_factor
+        week_games = np.flatnonzero((self.game_df.week == self.week).to_numpy())
+        for game in week_games[np.isin(self.game_rows[week_games], changed).any(axis=1)]:
+            slots = self.game_rows[game]
+            known = (slots >= 0) & np.isin(slots, obs.index)
+            mean = self.sampler['means'][game]
+            # Sigma_UO Sigma_OO^-1, least squares in case the observed block is singular
+            gain = np.linalg.lstsq(cov[np.ix_(known, known)], cov[np.ix_(known, ~known)], rcond=None)[0].T
+            cond_mean = mean[~known] + gain @ (obs.reindex(slots[known]).to_numpy() - mean[known])
+            cond_cov = cov[np.ix_(~known, ~known)] - gain @ cov[np.ix_(known, ~known)]
+            eig_val, eig_vec = np.linalg.eigh((cond_cov + cond_cov.T) / 2)
+            cond_factor = np.sqrt(np.clip(eig_val, 0, None))[:, np.newaxis] * eig_vec.T
+            draws = cond_mean + rng.standard_normal((self.n, len(cond_mean))) @ cond_factor
+            filled = slots[~known] >= 0
+            self.pts_mat[slots[~known][filled]] = draws[:, filled].T
+        # Bench players are independent of everyone else
+        bench_rows = self.draw_rows[len(self.sampler['game_idx']):]
+        redraw = np.isin(bench_rows, changed) & ~np.isin(bench_rows, obs.index)
+        self.pts_mat[bench_rows[redraw]] = self.sampler['bench_means'][redraw, np.newaxis] + \
+            self.sampler['bench_sd'][redraw, np.newaxis] * rng.standard_normal((redraw.sum(), self.n))
+        return changed
+
+    @profiled
+    def sample_pts(self, n, seed_seq):
+        '''
+        returns a fresh (score_df rows x n) float32 matrix of draws from a single seed stream
+        used to stream replications in batches without drawing pts_mat
+        '''
+        pts_mat = np.zeros((len(self.score_df), n), dtype=np.float32)
+        pts_mat[self.draw_rows] = _draw_shard(self.sampler, n, seed_seq)
+        return pts_mat
+
+    def player_pts(self, player_id, week):
+        '''
+        returns the n simulated scores of a player in a given week
+        '''
+        return self.pts_mat[self.pts_row[(player_id, week)]]
+
+    @profiled
     def pick_starters(self, df):
         '''
         Finds the top QB and TE, Top 2 WR and RB, then the top two of the remaining RB, TE, and WR
         for each team in each week and assigns them a True in the start field
+        players without a franchise (free agents) never start and have a fran_pos_rank of 0
         '''
-        df['fran_pos_rank'] = df.groupby(['id_franchise', 'week', 'position']).rank('dense', ascending=False).astype(int)['mean_pts']
+        rostered = df.id_franchise.notna()
+        df['fran_pos_rank'] = df.groupby(['id_franchise', 'week', 'position'])['mean_pts'].rank('dense', ascending=False).fillna(0).astype(int)
         # Assign position starters
-        df['start'] = (df.fran_pos_rank == 1) | (df.fran_pos_rank == 2) & (df.position.isin(['RB', 'WR']))
+        df['start'] = rostered & ((df.fran_pos_rank == 1) | (df.fran_pos_rank == 2) & (df.position.isin(['RB', 'WR'])))
         # Assign flex starters
-        flex_eligible = (~df.start) & (df.position.isin(['RB', 'WR', 'TE']))
-        df.loc[flex_eligible, 'flex_rank'] = df[flex_eligible].groupby(['id_franchise', 'week']).rank('dense', ascending=False).astype(int)['mean_pts']
+        flex_eligible = (~df.start) & (df.position.isin(['RB', 'WR', 'TE'])) & rostered
+        df.loc[flex_eligible, 'flex_rank'] = df[flex_eligible].groupby(['id_franchise', 'week'])['mean_pts'].rank('dense', ascending=False).astype(int)
         df.loc[df.flex_rank < 3, 'start'] = True
         return df
 
@@ -280,16 +556,26 @@ class Data_Generator():
         var_mat = np.array(var_mat)
         return var_mat @ self.corr_mat
     
+    def factor_cov_mat(self):
+        '''
+        factors the covariance matrix once so every game can be drawn as standard normal @ factor
+        uses the same SVD factorization as np.random.multivariate_normal since cov_mat is not symmetric
+        '''
+        (u, s, v) = np.linalg.svd(self.cov_mat)
+        return np.sqrt(s)[:, np.newaxis] * v
+
+    @profiled
     def read_weekly_projections(self):
         '''
         reads the weeks relevant folder in the weekly projections folder
         returns a datafrom of player projections
         '''
-        try:
-            proj_list = self.af.files_in_directory(data_folder='data/Weekly Projections/2021/week ' + str(self.week))
-        except:
+        folder = 'data/Weekly Projections/2021/week ' + str(self.week)
+        # files_in_directory returns an empty list for a missing folder rather than raising
+        proj_list = self.af.files_in_directory(data_folder=folder)
+        if not proj_list:
             print('*** NEED TO ADD NEW WEEKLY PROJECTIONS ***')
-            raise ValueError
+            raise ValueError('No weekly projections in ' + folder)
         df_list = [None] * len(proj_list)
         for i, proj in enumerate(proj_list):
             df = pd.read_csv(proj)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import pickle
+from src.Profiler import profile_count
+
+
+class Input_Cache():
+    '''
+    Compiles slow to parse input files (csv, xlsx) into a binary pickle the first time they are read
+    Each entry is keyed on the path, modification time and content hash of its source files
+    and is rebuilt automatically as soon as one of them changes
+    '''
+
+    # bump when the structure of a cached object changes
+    VERSION = 1
+
+    def __init__(self, cache_dir='data/cache'):
+        self.cache_dir = cache_dir
+
+    def load(self, name, sources, builder):
+        '''
+        returns the cached object called name if none of the source file paths changed
+        otherwise calls builder() and caches its result
+        '''
+        path = self.cache_path(name, sources)
+        entry = self.read_entry(path)
+        if entry is not None and self.is_fresh(entry, sources):
+            if entry['updated']:
+                # sources were touched but their content is identical, store the new mtimes
+                self.write_entry(path, entry)
+            profile_count('Input_Cache.' + name, 'cache_hits')
+            return entry['value']
+        profile_count('Input_Cache.' + name, 'cache_misses')
+        value = builder()
+        entry = {'version': self.VERSION,
+                 'sources': [self.file_signature(source) for source in sources],
+                 'value': value}
+        self.write_entry(path, entry)
+        return value
+
+    def cache_path(self, name, sources):
+        '''
+        returns the cache file of an object, the source paths are part of the key
+        '''
+        source_key = hashlib.sha1('|'.join(sources).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '{}_{}.pkl'.format(name, source_key))
+
+    def file_signature(self, path, sha=None):
+        '''
+        returns the path, modification time, size and content hash of a source file
+        '''
+        stat = os.stat(path)
+        return {'path': path,
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'sha': sha or self.file_hash(path)}
+
+    def file_hash(self, path):
+        '''
+        returns the sha256 of a file's content
+        '''
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def is_fresh(self, entry, sources):
+        '''
+        checks a cache entry against the source files, the content hash is only
+        recomputed for files whose modification time or size changed
+        '''
+        entry['updated'] = False
+        if entry.get('version') != self.VERSION or [s['path'] for s in entry['sources']] != list(sources):
+            return False
+        for i, signature in enumerate(entry['sources']):
+            if not os.path.exists(signature['path']):
+                return False
+            stat = os.stat(signature['path'])
+            if stat.st_mtime == signature['mtime'] and stat.st_size == signature['size']:
+                continue
+            sha = self.file_hash(signature['path'])
+            if sha != signature['sha']:
+                return False
+            entry['sources'][i] = self.file_signature(signature['path'], sha)
+            entry['updated'] = True
+        return True
+
+    def read_entry(self, path):
+        '''
+        returns the cache entry stored at path, None if it is missing or unreadable
+        '''
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def write_entry(self, path, entry):
+        '''
+        writes a cache entry atomically so a crashed run never leaves a half written file
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {key: value for key, value in entry.items() if key != 'updated'}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
@@ -0,0 +1,62 @@
+import json
+import os
+
+
+class Player_Index():
+    '''
+    Persistent index from MFL player id to the normalized name key used by the projection files
+    Built once, then only players that were never seen before are resolved and the index is saved again
+    Entries can be corrected by hand in the index file, they are never overwritten
+    '''
+
+    def __init__(self, path='data/player_index.json'):
+        self.path = path
+        self.index = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                self.index = json.load(f)
+
+    def normalize_names(self, names):
+        '''
+        accepts a series of MFL 'Last, First' names and returns the normalized projection keys
+        same rule as Data_Generator.normalize_name, first two words, lower case, letters only
+        '''
+        names = names.str.split(', ').str[::-1].str.join(' ')
+        return names.str.lower().str.split().str[0:2].str.join('').str.replace('[^a-z]', '', regex=True)
+
+    def update(self, players_df):
+        '''
+        adds the players of players_df (player_id, name_player) missing from the index
+        returns the number of players added
+        '''
+        new_df = players_df[~players_df.player_id.isin(list(self.index))].drop_duplicates('player_id')
+        if len(new_df) > 0:
+            self.index.update(zip(new_df.player_id, self.normalize_names(new_df.name_player)))
+            self.save()
+        return len(new_df)
+
+    def lookup(self, player_ids):
+        '''
+        returns the projection key of each player id in the series player_ids
+        '''
+        return player_ids.map(self.index)
+
+    def miss_report(self, players_df, proj_keys, pos_list):
+        '''
+        returns the players of players_df at a projected position whose key has no projection
+        these players are simulated with 0 mean points
+        '''
+        players_df = players_df.drop_duplicates('player_id')
+        keys = self.lookup(players_df.player_id)
+        miss = players_df.position.isin(pos_list) & ~keys.isin(set(proj_keys))
+        miss_df = players_df.loc[miss, ['player_id', 'name_player', 'position', 'team', 'id_franchise']]
+        return miss_df.assign(norm_name_player=keys[miss]).reset_index(drop=True)
+
+    def save(self):
+        '''
+        writes the index to its file
+        '''
+        if not self.path:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
@@ -0,0 +1,185 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+
+class Profiler():
+    '''
+    Records the wall time, CPU time, peak memory and output size of every pipeline stage
+    and the calls, cache hits and misses of every MFL endpoint and compiled input
+    Stages are the methods decorated with profiled, turn profiling on with start() or a with block
+    while no profiler is running the decorated methods only pay one attribute lookup
+    '''
+
+    # the running profiler, None when profiling is off
+    active = None
+
+    def __init__(self, memory=True, trace_path=None):
+        # tracemalloc slows down python allocations, pass memory=False for timings only
+        self.memory = memory
+        self.trace_path = trace_path
+        self.stats = {}
+        self.events = []
+        self.origin = time.perf_counter()
+        # stages nest per thread, the MFL calls of API.gather run in a thread pool
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        '''
+        makes this profiler the running one
+        '''
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        Profiler.active = self
+        return self
+
+    def stop(self):
+        '''
+        turns profiling off and writes the trace when trace_path is set
+        '''
+        Profiler.active = None
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.trace_path:
+            self.save_trace(self.trace_path)
+
+    @property
+    def stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def stage(self, name):
+        '''
+        returns the stats of a stage, created empty on first use
+        '''
+        if name not in self.stats:
+            self.stats[name] = {'calls': 0, 'wall_s': 0.0, 'self_wall_s': 0.0, 'cpu_s': 0.0, 'peak_mb': 0.0,
+                                'size': None}
+        return self.stats[name]
+
+    def record(self, name, func, args, kwargs):
+        '''
+        calls func(*args, **kwargs) as the stage called name and returns its result
+        '''
+        frame = {'nested': 0.0, 'peak': 0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['start_mem'] = current
+        self.stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            wall_s = time.perf_counter() - wall
+            cpu_s = time.process_time() - cpu
+            stack = self.stack
+            stack.pop()
+            size = self.size_of(result)
+            if self.memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1]['nested'] += wall_s
+                if self.memory:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            with self._lock:
+                stats = self.stage(name)
+                stats['calls'] += 1
+                stats['wall_s'] += wall_s
+                stats['self_wall_s'] += wall_s - frame['nested']
+                stats['cpu_s'] += cpu_s
+                if self.memory:
+                    stats['peak_mb'] = max(stats['peak_mb'], (peak - frame['start_mem']) / 2 ** 20)
+                if size is not None:
+                    stats['size'] = size
+                if self.trace_path:
+                    self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                        'ts': (wall - self.origin) * 1e6, 'dur': wall_s * 1e6,
+                                        'args': {'cpu_s': cpu_s, 'size': size}})
+
+    def count(self, name, counter):
+        '''
+        adds one to a counter of a stage, such as its cache hits
+        '''
+        with self._lock:
+            stats = self.stage(name)
+            stats[counter] = stats.get(counter, 0) + 1
+
+    def size_of(self, result):
+        '''
+        returns the shape of an array or dataframe result, or the length of a container
+        '''
+        shape = getattr(result, 'shape', None)
+        if shape is not None:
+            return list(shape)
+        if isinstance(result, (list, dict)):
+            return [len(result)]
+        return None
+
+    def report(self):
+        '''
+        returns a dataframe with one row per stage, the slowest first
+        '''
+        report_df = pd.DataFrame.from_dict(self.stats, orient='index')
+        report_df.index.name = 'stage'
+        return report_df.sort_values('self_wall_s', ascending=False)
+
+    def save_trace(self, path):
+        '''
+        writes the recorded stages as a chrome trace event file, open it in chrome://tracing or perfetto
+        '''
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'stats': self.stats}, f)
+
+
+def profiled(func):
+    '''
+    decorator recording every call of a method as a stage of the running profiler
+    '''
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = Profiler.active
+        if profiler is None:
+            return func(*args, **kwargs)
+        return profiler.record(name, func, args, kwargs)
+    return wrapper
+
+
+def profile_call(name, func, *args, **kwargs):
+    '''
+    calls func as the stage called name when profiling is on
+    '''
+    profiler = Profiler.active
+    if profiler is None:
+        return func(*args, **kwargs)
+    return profiler.record(name, func, args, kwargs)
+
+
+def profile_count(name, counter):
+    '''
+    adds one to a counter of a stage when profiling is on
+    '''
+    profiler = Profiler.active
+    if profiler is not None:
+        profiler.count(name, counter)
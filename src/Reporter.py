@@ -10,6 +10,7 @@ from IPython.core.display import clear_output
 import pandas as pd
 import xml.etree.ElementTree as ET 
 from tqdm import tqdm
+from src.Profiler import profiled
 tqdm.pandas()
 
 class Reporter():
@@ -55,6 +56,7 @@ class Reporter():
         franchise_players = self.add_player_info(franchise_players, id_field = 'player_id')
         return franchise_players
 
+    @profiled
     def roster_report(self, team_id=None):
         '''
         returns a dataframe of all players owned in the league with both team id's
@@ -65,6 +67,44 @@ class Reporter():
         franchise_players = franchise_players.drop(['week', 'id'], axis = 1)
         return franchise_players
     
+    @profiled
+    def free_agent_report(self, position=None):
+        '''
+        returns a dataframe of the league's free agents with the columns of roster_report, without a franchise
+        '''
+        free_agents = self.api.freeAgents(position=position, df=True)
+        free_agents = self.add_player_info(free_agents, id_field = 'player_id')
+        free_agents = free_agents.rename(columns = {'id': 'id_player', 'name': 'name_player'})
+        free_agents['id_franchise'] = None
+        free_agents['name_franchise'] = None
+        return free_agents[['id_franchise', 'player_id', 'player_status', 'id_player', 'name_player', 'position',
+                            'team', 'name_franchise']]
+
+    @profiled
+    def live_scores(self, week=None):
+        '''
+        returns the live points of every rostered player in the week's matchups
+        gameSecondsRemaining is 0 once the player's NFL game is over, NaN when MFL does not report it
+        '''
+        live = self.api.liveScoring(details=True, W=week)['liveScoring']
+        matchups = live.get('matchup', [])
+        matchups = matchups if type(matchups) == list else [matchups]
+        franchises = [franchise for matchup in matchups for franchise in matchup['franchise']]
+        rows = []
+        for franchise in franchises:
+            players = franchise.get('players', {}).get('player', [])
+            players = players if type(players) == list else [players]
+            rows += [{'id_franchise': franchise['id'],
+                      'player_id': player['id'],
+                      'status': player.get('status'),
+                      'score': player.get('score') or 0,
+                      'gameSecondsRemaining': player.get('gameSecondsRemaining')} for player in players]
+        live_df = pd.DataFrame(rows, columns = ['id_franchise', 'player_id', 'status', 'score', 'gameSecondsRemaining'])
+        live_df['score'] = live_df['score'].astype(float)
+        # A missing or blank time left is unknown, not a finished game
+        live_df['gameSecondsRemaining'] = pd.to_numeric(live_df['gameSecondsRemaining'], errors='coerce')
+        return live_df
+
     def roster_score_report(self, team_id=None):
         '''
         returns a dataframe of all rosters within the leagues with scores for the referenced week in the api class
@@ -0,0 +1,155 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class Result_Store():
+    '''
+    On disk store of a simulation, one memory mapped .npy file per column with one row per run
+    Batches are appended as they are simulated so runs larger than memory can be kept, and a finished
+    run can be re-analyzed later with Simulator.from_store without simulating again
+    player_pts holds the draws of every score_df row, team_pts the (weeks x franchises) team scores
+    and the qualify columns the standings of every run
+    '''
+
+    # bump when the layout of the files changes
+    VERSION = 1
+    standing_cols = ['wins', 'pts', 'div_rank', 'league_rank', 'wildcard_rank', 'made_playoffs', 'seeds']
+
+    def __init__(self, path, player_pts=True):
+        self.path = path
+        # the player draws are the largest column, pass player_pts=False to only keep team results
+        self.player_pts = player_pts
+        self.arrays = {}
+        self.meta = None
+        if os.path.exists(self.file('meta.json')):
+            with open(self.file('meta.json')) as f:
+                self.meta = json.load(f)
+            if self.meta['version'] != self.VERSION:
+                raise ValueError('Result store {} has version {}, expected {}'.format(
+                    path, self.meta['version'], self.VERSION))
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def runs(self):
+        return self.meta['runs'] if self.meta else 0
+
+    def create(self, sim):
+        '''
+        starts a new store for the simulation sim, replacing any results already in path
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        if self.meta is None:
+            if os.listdir(self.path):
+                raise ValueError('{} is not empty and is not a result store, pass an empty or new directory'.format(
+                    self.path))
+        else:
+            # only the store's own files are removed, anything else in path is left alone
+            for col in self.meta['columns']:
+                for name in (col + '.npy', col + '.npy.tmp'):
+                    if os.path.exists(self.file(name)):
+                        os.remove(self.file(name))
+        self.arrays = {}
+        self.meta = {'version': self.VERSION,
+                     'week': sim.week,
+                     'n': sim.n,
+                     'runs': 0,
+                     'playoff_weeks': sim.playoff_weeks,
+                     'wildcards': sim.wildcards,
+                     'fran_ids': sim.fran_ids,
+                     'fran_names': [sim.fran_id_to_name[fran_id] for fran_id in sim.fran_ids],
+                     'divisions': [str(division) for division in sim.divisions],
+                     'mu_week': sim.mu_week.tolist(),
+                     'mu_fran0': sim.mu_fran0.tolist(),
+                     'mu_fran1': sim.mu_fran1.tolist(),
+                     'columns': []}
+        if sim.dg is not None:
+            sim.dg.score_df.to_pickle(self.file('score_df.pkl'))
+        self.write_meta()
+
+    def append(self, pts_mat, team_pts, standings):
+        '''
+        writes a batch of runs, pts_mat is the (score_df rows x runs) matrix of player draws
+        '''
+        columns = {'team_pts': team_pts, **{col: standings[col] for col in self.standing_cols}}
+        if self.player_pts and pts_mat is not None:
+            columns['player_pts'] = pts_mat.T
+        start = self.runs
+        stop = start + len(team_pts)
+        for name, values in columns.items():
+            if name not in self.arrays or len(self.arrays[name]) < stop:
+                self.arrays[name] = self.grow(name, values, stop)
+            self.arrays[name][start:stop] = values
+            self.arrays[name].flush()
+        self.meta['runs'] = stop
+        self.write_meta()
+
+    def grow(self, name, values, runs):
+        '''
+        returns the file of a column resized to hold at least runs rows, keeping the rows already written
+        files double in size up to the simulation's n, so an adaptive run with a large n only takes the
+        space of the runs it actually draws
+        '''
+        old = self.arrays.get(name)
+        capacity = runs if old is None else min(max(runs, 2 * len(old)), max(self.meta['n'], runs))
+        tmp = self.file(name + '.npy.tmp')
+        array = np.lib.format.open_memmap(tmp, mode='w+', dtype=values.dtype, shape=(capacity,) + values.shape[1:])
+        if old is not None:
+            array[:self.runs] = old[:self.runs]
+            array.flush()
+        os.replace(tmp, self.file(name + '.npy'))
+        if name not in self.meta['columns']:
+            self.meta['columns'].append(name)
+        return array
+
+    def write_meta(self):
+        '''
+        writes the store description, the run count is only updated once a batch is fully written
+        '''
+        tmp = self.file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.file('meta.json'))
+
+    def load(self, name):
+        '''
+        returns a read only memory mapped view of the written runs of a column, nothing is read until used
+        '''
+        return np.load(self.file(name + '.npy'), mmap_mode='r')[:self.runs]
+
+    def standings(self, start=0, stop=None):
+        '''
+        returns the qualify standings of runs start to stop as memory mapped views
+        '''
+        return {col: self.load(col)[start:stop] for col in self.standing_cols}
+
+    def chunks(self, size):
+        '''
+        yields the team scores and standings of size runs at a time
+        '''
+        team_pts = self.load('team_pts')
+        for start in range(0, self.runs, size):
+            yield team_pts[start:start + size], self.standings(start, start + size)
+
+    def pts_mat(self):
+        '''
+        returns the (score_df rows x runs) player draws, a transposed view of the stored file
+        '''
+        return self.load('player_pts').T
+
+    def score_df(self):
+        return pd.read_pickle(self.file('score_df.pkl'))
+
+    def frame(self, col):
+        '''
+        returns one standings column as a dataframe with one row per run and franchise, for gb_report and the like
+        the col column is a view of the stored file, only the run index and the id column are built in memory
+        a single value column is never consolidated with other columns, which would copy it
+        '''
+        n_fran = len(self.meta['fran_ids'])
+        run = pd.Index(np.repeat(np.arange(self.runs), n_fran), name='run')
+        fran_id = pd.Categorical.from_codes(np.tile(np.arange(n_fran), self.runs), self.meta['fran_ids'])
+        return pd.DataFrame({'id': fran_id, col: self.load(col).reshape(-1)}, index=run, copy=False)
@@ -1,90 +1,624 @@
+import time
+from itertools import product
+import numpy as np
 import pandas as pd
+from functools import cached_property
+from src.Profiler import profiled
+from src.Result_Store import Result_Store
 pd.options.display.float_format = '{:,.2f}'.format
 
 class Simulator():
     '''
     Simulates a full BDFL season, evaluating and storing outcomes and results
+    every stage is computed on first access and memoized, see invalidate
     '''
 
-    def __init__(self, week, api, rep, dg, n):
+    # Pipeline order, invalidating a stage also drops every stage after it
+    stages = ['schedule', 'team_pts', 'week_wins', 'matchup_df', 'standings', 'rank_df', 'acc', 'team_df',
+              'outcome_df', 'finish_df', 'base_outcomes']
+    # Stages from_store reads from the Result_Store instead of simulating
+    store_stages = ['schedule', 'team_pts', 'standings']
+    # simulate_playoffs plays a bracket of exactly this many seeds
+    bracket_seeds = 6
+
+    def __init__(self, week, api, rep, dg, n, batch_size=None, lineup='mean', se_target=None, time_budget=None,
+                 store=None):
         self.week = week
         self.api = api
         self.rep = rep
         self.dg = dg
         self.n = n
+        # Adaptive mode streams batches until every playoff and matchup win probability has a standard
+        # error of at most se_target, or time_budget seconds are spent, n is then the most runs drawn
+        self.se_target = se_target
+        self.time_budget = time_budget
+        if batch_size is None and (se_target or time_budget):
+            batch_size = 1000
+        self.batch_size = batch_size
+        self.stop_reason = None
+        # Optional Result_Store (or its path) every simulated batch is written to
+        self.store = Result_Store(store) if isinstance(store, str) else store
+        self.stored = False
+        # 'mean' starts the lineup picked from mean_pts, 'optimal' the best lineup of every run
+        self.lineup = lineup
+        # Six team bracket, seeds 1 and 2 get a bye, the final is scored over two weeks
+        self.playoff_weeks = [[14], [15], [16, 17]]
+        # Every division winner makes the playoffs, joined by the best remaining records
+        self.wildcards = 2
         self.fran_id_to_name = self.gen_fran_id_to_name()
-        self.matchup_df = self.simulate()
-        self.team_df = self.team_performance()
-        self.rank_df = self.select_playoff_teams()
-        self.outcome_df = self.team_outcomes()
+        self.fran_ids = list(self.fran_id_to_name)
+        self.weeks_rem = list(range(self.week, 14))
+        self.sim_weeks = list(range(self.week, max(self.playoff_weeks[-1]) + 1))
+
+    @classmethod
+    def from_store(cls, store, batch_size=10000):
+        '''
+        returns a Simulator reading the results written to a Result_Store (or its path) instead of simulating
+        the outputs are rebuilt from memory mapped chunks of batch_size runs, nothing is drawn again
+        '''
+        store = Result_Store(store) if isinstance(store, str) else store
+        meta = store.meta
+        sim = cls.__new__(cls)
+        sim.week = meta['week']
+        sim.api = sim.rep = sim.dg = None
+        sim.n = store.runs
+        sim.batch_size = batch_size
+        sim.lineup = 'mean'
+        sim.se_target = sim.time_budget = None
+        sim.stop_reason = None
+        sim.store = store
+        sim.stored = True
+        sim.playoff_weeks = meta['playoff_weeks']
+        sim.wildcards = meta['wildcards']
+        sim.fran_id_to_name = dict(zip(meta['fran_ids'], meta['fran_names']))
+        sim.fran_ids = list(meta['fran_ids'])
+        sim.weeks_rem = list(range(sim.week, 14))
+        sim.sim_weeks = list(range(sim.week, max(sim.playoff_weeks[-1]) + 1))
+        sim.__dict__['schedule'] = tuple(np.array(meta[col], dtype=int) for col in ['mu_week', 'mu_fran0', 'mu_fran1'])
+        sim.__dict__['divisions'] = np.array(meta['divisions'], dtype=object)
+        sim.__dict__['team_pts'] = store.load('team_pts')
+        sim.__dict__['standings'] = store.standings()
+        return sim
+
+    def invalidate(self, stage=None):
+        '''
+        drops a memoized stage and every stage after it, all of them when stage is None
+        call after changing dg, lineup or n so the next access recomputes
+        a Simulator from a Result_Store keeps the stages read from the store, they cannot be recomputed
+        '''
+        start = 0 if stage is None else self.stages.index(stage)
+        for name in self.stages[start:]:
+            if self.stored and name in self.store_stages:
+                continue
+            self.__dict__.pop(name, None)
+
+    @cached_property
+    def schedule(self):
+        '''
+        the remaining regular season matchups as parallel arrays of week, franchise 0 and franchise 1 index
+        '''
+        sched_list = self.api.leagueSched()['schedule']['weeklySchedule']
+        return self.matchup_arrays(sched_list, self.weeks_rem)
+
+    @property
+    def mu_week(self):
+        return self.schedule[0]
+
+    @property
+    def mu_fran0(self):
+        return self.schedule[1]
+
+    @property
+    def mu_fran1(self):
+        return self.schedule[2]
+
+    def update_week(self, week=None):
+        '''
+        recomputes the team scores of one week, the current week by default, after its draws changed
+        as with Data_Generator.apply_weekly_projections, the team scores of the other weeks are kept
+        and every output after team_pts is recomputed on its next access
+        '''
+        week = self.week if week is None else week
+        if 'team_pts' in self.__dict__ and not self.stored:
+            self.team_pts[:, week - self.week, :] = self.team_score_tensor([week])[:, 0, :]
+        self.invalidate('week_wins')
 
+    @profiled
+    def live_update(self, live_df=None):
+        '''
+        conditions the current week on the players whose NFL games are over and returns its week_outcome
+        live_df (player_id, score, gameSecondsRemaining) defaults to a poll of MFL liveScoring
+        only the games whose final scores changed since the last poll are redrawn and only this week's
+        team scores are recomputed, call it on every poll, liveScoring responses are cached for
+        API.CACHE_TTL['liveScoring'] seconds
+        players in games still being played are simulated as if their game had not started
+        '''
+        if self.batch_size:
+            raise ValueError('live_update needs the simulated draws, run without batch_size')
+        live_df = self.rep.live_scores(self.week) if live_df is None else live_df
+        # Players without a known time left are not final
+        final = live_df[pd.to_numeric(live_df.gameSecondsRemaining, errors='coerce') == 0]
+        changed = self.dg.condition_week(pd.Series(final.score.astype(float).to_numpy(), index=final.player_id))
+        if len(changed) > 0:
+            self.update_week(self.week)
+        return self.week_outcome(self.week)
+
+    @cached_property
+    def team_pts(self):
+        '''
+        (runs x weeks x franchises) team scores for every replication at once, playoff weeks included
+        '''
+        return self.team_score_tensor(self.sim_weeks)
+
+    @cached_property
+    def matchup_df(self):
+        '''
+        every game of every run, None in streaming mode
+        '''
+        return None if self.batch_size else self.simulate()
+
+    @cached_property
+    def divisions(self):
+        '''
+        the division of each franchise, in fran_ids order
+        '''
+        fran_list = self.api.league()['league']['franchises']['franchise']
+        division = {fran['id']: fran.get('division', '') for fran in fran_list}
+        return np.array([division[fran_id] for fran_id in self.fran_ids], dtype=object)
+
+    @cached_property
+    def standings(self):
+        '''
+        the (runs x franchises) records, ranks and playoff flags of every run
+        '''
+        return self.qualify(self.team_pts)
+
+    @cached_property
+    def rank_df(self):
+        '''
+        the league finish of every franchise in every run, None in streaming mode
+        '''
+        return None if self.batch_size else self.select_playoff_teams()
+
+    @cached_property
+    def acc(self):
+        '''
+        running totals that every season output table is built from
+        '''
+        acc = self.new_accumulators()
+        if self.stored:
+            # Re-analysis of a Result_Store, the memory mapped files are read chunk by chunk
+            for team_pts, standings in self.store.chunks(self.batch_size):
+                self.accumulate(acc, team_pts, standings)
+            return acc
+        if self.store is not None:
+            self.store.create(self)
+        if self.batch_size:
+            # Streaming mode, replications are drawn in batches and only the accumulators are kept
+            self.stream(acc)
+        else:
+            self.accumulate(acc, self.team_pts, self.standings)
+            self.save_batch(self.dg.pts_mat, self.team_pts, self.standings)
+        return acc
+
+    @cached_property
+    def team_df(self):
+        return self.team_performance()
+
+    @cached_property
+    def outcome_df(self):
+        return self.team_outcomes()
+
+    @cached_property
+    def finish_df(self):
+        return self.finish_distribution()
+
+    @cached_property
+    def week_wins(self):
+        '''
+        memo of the head to head wins of franchise 0 in the matchups of single weeks, filled by week_outcome
+        '''
+        return {}
+
+    @profiled
     def simulate(self):
         '''
         simulates an MFL season n times
         returns a dataframe of all games that occured during each season
         '''
-        # Pull fantasy schedule from MFL
-        sched_list = self.api.leagueSched()['schedule']['weeklySchedule']
-        score_df = self.dg.score_df.copy()
-        # TODO: Simulate the playoffs
-        # TODO: Simulate the bench players
-        weeks_rem = range(self.week, 14)
-        matchup_list = [None] * self.n * len(weeks_rem) * 6
-        for run in range(0, self.n):  # Every replication of the season
-            for week in weeks_rem:  # Every week in the season
-                for i, matchup in enumerate(sched_list[week - 1]['matchup']):
-                    id0 = matchup['franchise'][0]['id']
-                    id1 = matchup['franchise'][1]['id']
-                    t0_players = (score_df.week == week) & (score_df.id_franchise == id0) & (score_df['start'])
-                    t1_players = (score_df.week == week) & (score_df.id_franchise == id1) & (score_df['start'])
-                    team0_pts = score_df.loc[t0_players, 'pts'].str[run].sum()
-                    team1_pts = score_df.loc[t1_players, 'pts'].str[run].sum()
-                    mu_idx = run*len(weeks_rem)*6+(week-1)*6+i
-                    matchup_list[mu_idx] = [run, week, id0, team0_pts, id1, team1_pts]
-        # Store results in dataframe
-        matchup_df = pd.DataFrame(matchup_list, columns=['run', 'week', 'id0', 'team0_pts', 'id1', 'team1_pts'])
-        matchup_df.loc[matchup_df.team0_pts > matchup_df.team1_pts, 'winner'] = matchup_df.id0
+        return self.matchup_frame(self.team_pts)
+
+    @profiled
+    def stream(self, acc):
+        '''
+        simulates an MFL season n times in batches of batch_size replications, adding each batch to acc
+        each batch draws its own player scores from the matching Data_Generator seed stream
+        memory use depends on batch_size, never on n, dg.pts_mat is never drawn
+        '''
+        for batch, size in self.batches(lambda: self.max_se(np.concatenate([acc['playoffs'], acc['fran0_wins']]),
+                                                            acc['runs'])):
+            pts_mat = self.dg.sample_pts(size, self.dg.shard_seed(batch))
+            team_pts = self.team_score_tensor(self.sim_weeks, pts_mat)
+            standings = self.qualify(team_pts)
+            self.accumulate(acc, team_pts, standings)
+            self.save_batch(pts_mat, team_pts, standings)
+
+    def save_batch(self, pts_mat, team_pts, standings):
+        '''
+        appends a batch of runs to the result store, when there is one
+        '''
+        if self.store is not None and not self.stored:
+            self.store.append(pts_mat, team_pts, standings)
+
+    def batches(self, current_se):
+        '''
+        yields the number and size of each streaming batch until n runs are drawn, the largest standard
+        error returned by current_se is at most se_target, or the next batch would overrun time_budget
+        the reason the loop ended is kept in stop_reason
+        '''
+        began = time.perf_counter()
+        self.stop_reason = 'n'
+        for batch, start in enumerate(range(0, self.n, self.batch_size)):
+            if batch > 0 and self.se_target and current_se() <= self.se_target:
+                self.stop_reason = 'se_target'
+                return
+            # Expect the next batch to take as long as the average batch so far
+            elapsed = time.perf_counter() - began
+            if batch > 0 and self.time_budget and elapsed * (batch + 1) / batch > self.time_budget:
+                self.stop_reason = 'time_budget'
+                return
+            yield batch, min(self.batch_size, self.n - start)
+
+    def max_se(self, counts, runs):
+        '''
+        returns the largest standard error of the probabilities counts / runs
+        one success and one failure are added so that 0 or 1 after a few runs does not look exact
+        '''
+        if runs == 0 or len(counts) == 0:
+            return np.inf if runs == 0 else 0.0
+        prob = (counts + 1) / (runs + 2)
+        return np.sqrt(prob * (1 - prob) / runs).max()
+
+    def std_error(self, prob, runs):
+        '''
+        returns the standard error of the probabilities prob estimated from runs replications
+        '''
+        return np.sqrt(prob * (1 - prob) / max(runs, 1))
+
+    def matchup_pts(self, team_pts):
+        '''
+        returns two (runs x matchups) arrays of the scores of each side of every matchup
+        '''
+        week_idx = self.mu_week - self.week
+        return team_pts[:, week_idx, self.mu_fran0], team_pts[:, week_idx, self.mu_fran1]
+
+    @profiled
+    def matchup_frame(self, team_pts, run_offset=0):
+        '''
+        returns a dataframe with one row per run and matchup from the team score tensor
+        '''
+        team0_pts, team1_pts = self.matchup_pts(team_pts)
         # TODO: Allow for ties
-        matchup_df.winner = matchup_df.winner.fillna(matchup_df.id1)
+        winner = np.where(team0_pts > team1_pts, self.mu_fran0, self.mu_fran1)
+        fran_ids = np.array(self.fran_ids, dtype=object)
+        n_runs, n_matchups = team0_pts.shape
+        matchup_df = pd.DataFrame({'run': np.repeat(np.arange(run_offset, run_offset + n_runs), n_matchups),
+                                   'week': np.tile(self.mu_week, n_runs),
+                                   'id0': np.tile(fran_ids[self.mu_fran0], n_runs),
+                                   'team0_pts': team0_pts.ravel(),
+                                   'id1': np.tile(fran_ids[self.mu_fran1], n_runs),
+                                   'team1_pts': team1_pts.ravel(),
+                                   'winner': fran_ids[winner.ravel()]})
         return matchup_df
 
+    def new_accumulators(self):
+        '''
+        returns empty running totals, their size does not depend on n
+        '''
+        n_fran = len(self.fran_ids)
+        return {'runs': 0,
+                    'wins': np.zeros(n_fran, dtype=int),
+                    'games': np.zeros(n_fran),
+                    'pts_sum': np.zeros(n_fran),
+                    'pts_sumsq': np.zeros(n_fran),
+                    'pts_max': np.full(n_fran, -np.inf),
+                    'pts_min': np.full(n_fran, np.inf),
+                    'playoffs': np.zeros(n_fran),
+                    'league_rank_sum': np.zeros(n_fran),
+                    'league_rank_counts': np.zeros((n_fran, n_fran)),
+                    'semifinal': np.zeros(n_fran),
+                    'final': np.zeros(n_fran),
+                    'title': np.zeros(n_fran),
+                    'fran0_wins': None}
+
+    @profiled
+    def accumulate(self, acc, team_pts, standings):
+        '''
+        adds a batch of replications and their standings from qualify to the running accumulators acc
+        '''
+        team0_pts, team1_pts = self.matchup_pts(team_pts)
+        n_fran = len(self.fran_ids)
+        n_runs = team0_pts.shape[0]
+        acc['runs'] += n_runs
+        # Head to head wins of franchise 0 in each matchup
+        fran0_wins = (team0_pts > team1_pts).sum(axis=0)
+        acc['fran0_wins'] = fran0_wins if acc['fran0_wins'] is None else acc['fran0_wins'] + fran0_wins
+        acc['wins'] += (np.bincount(self.mu_fran0, fran0_wins, n_fran) +
+                        np.bincount(self.mu_fran1, n_runs - fran0_wins, n_fran)).astype(int)
+        # Point totals over both sides of every matchup
+        game_fran = np.concatenate([self.mu_fran0, self.mu_fran1])
+        game_pts = np.concatenate([team0_pts, team1_pts], axis=1).astype(float)
+        acc['games'] += np.bincount(game_fran, minlength=n_fran) * n_runs
+        acc['pts_sum'] += np.bincount(game_fran, game_pts.sum(axis=0), n_fran)
+        acc['pts_sumsq'] += np.bincount(game_fran, (game_pts ** 2).sum(axis=0), n_fran)
+        if n_runs > 0:
+            np.maximum.at(acc['pts_max'], game_fran, game_pts.max(axis=0))
+            np.minimum.at(acc['pts_min'], game_fran, game_pts.min(axis=0))
+        # Playoff and league finish counts
+        acc['playoffs'] += standings['made_playoffs'].sum(axis=0)
+        acc['league_rank_sum'] += standings['league_rank'].sum(axis=0)
+        rank_key = np.arange(n_fran) * n_fran + standings['league_rank'] - 1
+        acc['league_rank_counts'] += np.bincount(rank_key.ravel(), minlength=n_fran ** 2).reshape(n_fran, n_fran)
+        # Playoff bracket, only while it is decided by the simulated regular season
+        if n_runs > 0 and self.bracket_played:
+            playoffs = self.simulate_playoffs(team_pts, standings['seeds'])
+            for stage, teams in zip(['semifinal', 'final', 'title'], playoffs):
+                acc[stage] += np.bincount(teams.ravel(), minlength=n_fran)
+
+    @profiled
+    def qualify(self, team_pts):
+        '''
+        ranks every franchise of every run on regular season wins, then points scored
+        returns a dict of (runs x franchises) arrays wins, pts, div_rank, league_rank, wildcard_rank and
+        made_playoffs, and seeds, the (runs x playoff teams) franchise index of each playoff seed
+        division winners are seeded first, then the wildcards, each ordered by record
+        a tie on both wins and points goes to the franchise listed first in the league
+        '''
+        team0_pts, team1_pts = self.matchup_pts(team_pts)
+        fran_onehot = np.eye(len(self.fran_ids))
+        fran0_win = (team0_pts > team1_pts).astype(float)
+        wins = np.rint(fran0_win @ fran_onehot[self.mu_fran0] + (1 - fran0_win) @ fran_onehot[self.mu_fran1])
+        wins = wins.astype(int)
+        pts = team0_pts @ fran_onehot[self.mu_fran0] + team1_pts @ fran_onehot[self.mu_fran1]
+        _, division = np.unique(self.divisions.astype(str), return_inverse=True)
+        division = np.broadcast_to(division, wins.shape)
+        # np.lexsort sorts on the last key first and is stable, so the franchise order breaks exact ties
+        league_rank = self.order_rank(np.lexsort((-pts, -wins), axis=1))
+        # Positions in the division sorted order, less the position the franchise's division starts at
+        div_start = np.searchsorted(np.sort(division[0]), division[0])
+        div_rank = self.order_rank(np.lexsort((-pts, -wins, division), axis=1)) - div_start
+        div_winner = div_rank == 1
+        wildcard_rank = np.where(div_winner, np.nan, self.order_rank(np.lexsort((-pts, -wins, div_winner), axis=1)))
+        made_playoffs = div_winner | (wildcard_rank <= self.wildcards)
+        seeds = np.lexsort((-pts, -wins, ~div_winner, ~made_playoffs), axis=1)[:, :self.n_seeds]
+        return {'wins': wins,
+                'pts': pts,
+                'div_rank': div_rank,
+                'league_rank': league_rank,
+                'wildcard_rank': wildcard_rank,
+                'made_playoffs': made_playoffs,
+                'seeds': seeds}
+
+    @property
+    def bracket_played(self):
+        '''
+        whether the bracket is simulated, it needs a full bracket of seeds and regular season games left to seed it
+        once the regular season is over the seeds would only follow the league order, so nothing is reported
+        '''
+        return bool(self.weeks_rem) and self.week <= self.playoff_weeks[0][0] and self.n_seeds == self.bracket_seeds
+
+    @property
+    def n_seeds(self):
+        '''
+        the number of playoff teams, every division winner and the wildcards
+        '''
+        return min(len(np.unique(self.divisions.astype(str))) + self.wildcards, len(self.fran_ids))
+
+    def order_rank(self, order):
+        '''
+        turns a (runs x franchises) argsort into the 1 based rank of every franchise
+        '''
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.broadcast_to(np.arange(1, order.shape[1] + 1), order.shape), axis=1)
+        return ranks
+
+    @profiled
+    def simulate_playoffs(self, team_pts, seeds):
+        '''
+        plays the six seed playoff bracket for every run at once
+        returns the (runs x teams) franchise indices reaching the semifinal, the final and winning the title
+        the higher seed advances on a tie
+        '''
+        runs = np.arange(seeds.shape[0])
+        round_pts = [team_pts[:, [week - self.week for week in weeks], :].sum(axis=1) for weeks in self.playoff_weeks]
+
+        def play(pts, top, bottom):
+            # top and bottom are 0 based seed numbers, returns the seed number of the winner
+            top_pts = pts[runs, seeds[runs, top]]
+            bottom_pts = pts[runs, seeds[runs, bottom]]
+            return np.where(top_pts >= bottom_pts, top, bottom)
+
+        def seed_of(n):
+            return np.full(len(runs), n)
+
+        # Wildcard round, 3 vs 6 and 4 vs 5
+        win_36 = play(round_pts[0], seed_of(2), seed_of(5))
+        win_45 = play(round_pts[0], seed_of(3), seed_of(4))
+        # Semifinals, the top seed plays the lowest remaining seed
+        semi_1 = play(round_pts[1], seed_of(0), np.maximum(win_36, win_45))
+        semi_2 = play(round_pts[1], seed_of(1), np.minimum(win_36, win_45))
+        champ = play(round_pts[2], np.minimum(semi_1, semi_2), np.maximum(semi_1, semi_2))
+        semifinal = seeds[runs[:, np.newaxis], np.stack([seed_of(0), seed_of(1), win_36, win_45], axis=1)]
+        final = seeds[runs[:, np.newaxis], np.stack([semi_1, semi_2], axis=1)]
+        title = seeds[runs, champ]
+        return semifinal, final, title
+
+    @profiled
+    def team_score_tensor(self, weeks, pts_mat=None, score_df=None, fran_ids=None):
+        '''
+        returns a (runs x weeks x franchises) array of simulated team scores
+        the starters of each franchise are gathered and summed in one pass over every run
+        pts_mat and score_df default to the Data_Generator draws and rosters, score_df index must
+        be the pts_mat row of each player-week, fran_ids the id_franchise of each column, default fran_ids
+        '''
+        pts_mat = self.dg.pts_mat if pts_mat is None else pts_mat
+        score_df = self.dg.score_df if score_df is None else score_df
+        fran_ids = self.fran_ids if fran_ids is None else fran_ids
+        if self.lineup == 'optimal':
+            return self.optimal_team_tensor(weeks, pts_mat, score_df, fran_ids)
+        n_runs = pts_mat.shape[1]
+        fran_idx = score_df.id_franchise.map({fran_id: i for i, fran_id in enumerate(fran_ids)})
+        starters = score_df['start'] & score_df.week.isin(weeks) & fran_idx.notna()
+        starter_df = score_df[starters]
+        pts = pts_mat[starter_df.index.to_numpy()]
+        groups = (starter_df.week.to_numpy() - weeks[0]) * len(fran_ids) + fran_idx[starters].to_numpy().astype(int)
+        team_pts = self.group_sum(pts, groups, len(weeks) * len(fran_ids))
+        return team_pts.T.reshape(n_runs, len(weeks), len(fran_ids))
+
+    def optimal_team_tensor(self, weeks, pts_mat, score_df, fran_ids=None):
+        '''
+        returns a (runs x weeks x franchises) array of team scores starting the best possible lineup
+        of every run, 1 QB, 2 RB, 2 WR, 1 TE and the best 2 remaining RB/WR/TE as flex
+        '''
+        fran_ids = self.fran_ids if fran_ids is None else fran_ids
+        n_runs = pts_mat.shape[1]
+        n_groups = len(weeks) * len(fran_ids)
+        pos_list = ['QB', 'RB', 'WR', 'TE']
+        fran_idx = score_df.id_franchise.map({fran_id: i for i, fran_id in enumerate(fran_ids)})
+        roster = score_df.week.isin(weeks) & fran_idx.notna() & score_df.position.isin(pos_list)
+        roster_df = score_df[roster]
+        groups = (roster_df.week.to_numpy() - weeks[0]) * len(fran_ids) + fran_idx[roster].to_numpy().astype(int)
+        pos_idx = roster_df.position.map({pos: i for i, pos in enumerate(pos_list)}).to_numpy()
+        slot_key = groups * len(pos_list) + pos_idx
+        depth = pd.Series(slot_key).groupby(slot_key).cumcount().to_numpy()
+        # (franchise weeks x positions x depth) roster slots, -1 when empty
+        slots = np.full((n_groups, len(pos_list), depth.max() + 1 if len(depth) else 1), -1)
+        slots[groups, pos_idx, depth] = roster_df.index.to_numpy()
+        pts = np.where((slots >= 0)[..., np.newaxis], pts_mat[slots], -np.inf)
+        pts = -np.sort(-pts, axis=2)
+        qb, rb, wr, te = pts[:, 0], pts[:, 1], pts[:, 2], pts[:, 3]
+        flex = np.concatenate([rb[:, 2:], wr[:, 2:], te[:, 1:]], axis=1)
+        flex = -np.sort(-flex, axis=1)
+        lineup = np.concatenate([qb[:, :1], rb[:, :2], wr[:, :2], te[:, :1], flex[:, :2]], axis=1)
+        # Empty lineup spots score 0
+        team_pts = np.where(np.isfinite(lineup), lineup, 0).sum(axis=1)
+        return team_pts.T.reshape(n_runs, len(weeks), len(fran_ids))
+
+    @profiled
+    def lineup_comparison(self, pts_mat=None):
+        '''
+        compares the lineup picked from mean_pts against the best lineup of every run
+        returns the points per game of both and the points left on the bench by each franchise
+        a Simulator from a Result_Store compares the player draws and rosters kept in the store
+        '''
+        score_df = None
+        if self.stored:
+            if 'player_pts' not in self.store.meta['columns']:
+                raise ValueError('lineup_comparison needs the player draws, the store has no player_pts')
+            pts_mat = self.store.pts_mat() if pts_mat is None else pts_mat
+            score_df = self.store.score_df()
+        lineup = self.lineup
+        try:
+            self.lineup = 'mean'
+            mean_pts = self.team_score_tensor(self.weeks_rem, pts_mat, score_df)
+            self.lineup = 'optimal'
+            optimal_pts = self.team_score_tensor(self.weeks_rem, pts_mat, score_df)
+        finally:
+            self.lineup = lineup
+        lineup_df = pd.DataFrame(index=pd.Index(self.fran_ids, name='id'))
+        lineup_df['mean_lineup_ppg'] = mean_pts.mean(axis=(0, 1))
+        lineup_df['optimal_lineup_ppg'] = optimal_pts.mean(axis=(0, 1))
+        lineup_df['bench_ppg_lost'] = lineup_df.optimal_lineup_ppg - lineup_df.mean_lineup_ppg
+        lineup_df['optimal_share'] = np.isclose(mean_pts, optimal_pts).mean(axis=(0, 1))
+        return self.show_fran_name(lineup_df)
+
+    def group_sum(self, values, groups, n_groups):
+        '''
+        sums the rows of values sharing a group id, returns an (n_groups x columns) array
+        groups without any rows sum to 0
+        '''
+        totals = np.zeros((n_groups, values.shape[1]))
+        if len(groups) == 0:
+            return totals
+        order = np.argsort(groups, kind='stable')
+        groups = groups[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        totals[groups[starts]] = np.add.reduceat(values[order], starts, axis=0)
+        return totals
+
+    def matchup_arrays(self, sched_list, weeks):
+        '''
+        flattens the MFL schedule into parallel arrays of week, franchise 0 index and franchise 1 index
+        '''
+        fran_to_idx = {fran_id: i for i, fran_id in enumerate(self.fran_ids)}
+        mu_week, mu_fran0, mu_fran1 = [], [], []
+        for week in weeks:
+            for matchup in sched_list[week - 1]['matchup']:
+                mu_week.append(week)
+                mu_fran0.append(fran_to_idx[matchup['franchise'][0]['id']])
+                mu_fran1.append(fran_to_idx[matchup['franchise'][1]['id']])
+        return np.array(mu_week, dtype=int), np.array(mu_fran0, dtype=int), np.array(mu_fran1, dtype=int)
+
+    @profiled
     def team_performance(self):
-        team_df = pd.DataFrame()
-        team_df['total_wins'] = self.matchup_df.rename(columns={'winner': 'team'}).groupby('team')['week'].agg('count')
-        team_df['average_wins'] = team_df.total_wins / self.n
-        team_df[['total_pts', 'mean_ppg', 'std_ppg', 'max_game', 'min_game']] = \
-            self.matchup_df.groupby('id0')['team0_pts'].agg(['sum', 'mean', 'std', 'max', 'min']) + \
-            self.matchup_df.groupby('id1')['team1_pts'].agg(['sum', 'mean', 'std', 'max', 'min'])
+        '''
+        returns the wins and points scored by each franchise over every simulated game
+        '''
+        acc = self.acc
+        team_df = pd.DataFrame(index=pd.Index(self.fran_ids, name='team'))
+        team_df['total_wins'] = acc['wins']
+        team_df['average_wins'] = acc['wins'] / acc['runs']
+        team_df['total_pts'] = acc['pts_sum']
+        team_df['mean_ppg'] = acc['pts_sum'] / acc['games']
+        team_df['std_ppg'] = np.sqrt(np.maximum(acc['pts_sumsq'] - acc['pts_sum'] ** 2 / acc['games'], 0) /
+                                     (acc['games'] - 1))
+        team_df['max_game'] = acc['pts_max']
+        team_df['min_game'] = acc['pts_min']
         return self.show_fran_name(team_df)
 
-    def select_playoff_teams(self):
-        # # Calculate Playoffs
-        rosters = self.api.league(df=True)
-        df = self.matchup_df.merge(rosters[['id', 'division']], left_on='winner', right_on='id', how='left')
-        gb_wins = df.groupby(['run', 'id', 'division'])['winner'].agg('count').reset_index()
-        # Account for pts scored tiebreaker
-        scores_df = \
-            df.groupby(['run', 'id0'])['team0_pts'].agg('sum') + \
-            df.groupby(['run', 'id1'])['team1_pts'].agg('sum')
-        rank_df = gb_wins.merge(scores_df.reset_index(), left_on=['id', 'run'], right_on=['id0', 'run'])
-        # Normalize season points scores between 0 and 1
-        normalized_scores = rank_df[0]/rank_df[0].max()
-        rank_df['score'] = rank_df['winner'] + normalized_scores
-        rank_df['div_rank'] = rank_df.groupby(['run', 'division'])['score'].rank(ascending=False)
-        # Award at large bids
-        rank_df['league_rank'] = rank_df.groupby(['run'])['score'].rank(ascending=False)
-        rank_df['wildcard_rank'] = rank_df.loc[rank_df.div_rank > 1, :]\
-            .groupby(['run'])['score']\
-            .rank(ascending=False)
-        rank_df['made_playoffs'] = (rank_df.wildcard_rank < 3) | (rank_df.div_rank == 1)
-        del rank_df[0]
+    @profiled
+    def select_playoff_teams(self, standings=None, run_offset=0):
+        '''
+        returns a dataframe of the record, ranks and playoff flag of every franchise in every run
+        standings defaults to the qualification of the simulated season
+        '''
+        standings = self.standings if standings is None else standings
+        n_runs, n_fran = standings['wins'].shape
+        rank_df = pd.DataFrame({'run': np.repeat(np.arange(run_offset, run_offset + n_runs), n_fran),
+                                'id': np.tile(np.array(self.fran_ids, dtype=object), n_runs),
+                                'division': np.tile(self.divisions, n_runs)})
+        for col in ['wins', 'pts', 'div_rank', 'league_rank', 'wildcard_rank', 'made_playoffs']:
+            rank_df[col] = standings[col].ravel()
         return rank_df
 
+    @profiled
     def team_outcomes(self):
-        outcome_df = pd.DataFrame(self.rank_df.groupby('id')['made_playoffs'].agg('mean'))
-        outcome_df['average_league_finish'] = self.rank_df.groupby('id')['league_rank'].agg('mean')
+        '''
+        returns the playoff chances and average league finish of each franchise
+        '''
+        acc = self.acc
+        outcome_df = pd.DataFrame(index=pd.Index(self.fran_ids, name='id'))
+        # Without regular season games left the standings only follow the league order
+        season_left = bool(self.weeks_rem)
+        outcome_df['made_playoffs'] = acc['playoffs'] / acc['runs'] if season_left else np.nan
+        outcome_df['made_playoffs_se'] = self.std_error(outcome_df.made_playoffs, acc['runs'])
+        outcome_df['average_league_finish'] = acc['league_rank_sum'] / acc['runs'] if season_left else np.nan
+        for col, stage in [('made_semifinal', 'semifinal'), ('made_final', 'final'), ('won_title', 'title')]:
+            outcome_df[col] = acc[stage] / acc['runs'] if self.bracket_played else np.nan
         return self.show_fran_name(outcome_df)
 
+    @profiled
+    def finish_distribution(self):
+        '''
+        returns the chance of each franchise finishing in each league position, one column per finish
+        '''
+        acc = self.acc
+        n_fran = len(self.fran_ids)
+        finish = acc['league_rank_counts'] / acc['runs'] if self.weeks_rem else np.full((n_fran, n_fran), np.nan)
+        finish_df = pd.DataFrame(finish, index=pd.Index(self.fran_ids, name='id'),
+                                 columns=pd.Index(np.arange(1, n_fran + 1), name='league_finish'))
+        return self.show_fran_name(finish_df)
+
     def gen_fran_id_to_name(self):
         fran_list = self.api.league()['league']['franchises']['franchise']
         fran_id_to_name = {fran['id']: fran['name'] for fran in fran_list}
@@ -97,16 +631,208 @@ class Simulator():
     def week_outcome(self, week):
         '''
         returns the chance of each team winning their matchup that week
+        when the season has not been simulated yet only that week is, skipping the playoffs and rankings
         '''
-        show_df = self.matchup_df[self.matchup_df.week == week]
-        show_df.id0 = show_df.id0.map(self.fran_id_to_name)
-        show_df.id1 = show_df.id1.map(self.fran_id_to_name)
-        show_df.winner = show_df.winner.map(self.fran_id_to_name)
-        show_df['matchup'] = show_df.id0 + ' vs. ' + show_df.id1
-        show_gb = show_df.groupby(['matchup', 'winner'])['run'].agg('count') / self.n
-        show_gb = show_gb[show_gb >= 0.5]
-        show_gb = show_gb.reset_index().rename(columns={'run': 'win_probability'})
-        return show_gb
-        
+        in_week = self.mu_week == week
+        fran0 = self.mu_fran0[in_week]
+        fran1 = self.mu_fran1[in_week]
+        # Ties go to franchise 1, same as simulate
+        if 'acc' in self.__dict__ or self.stored:
+            runs = self.acc['runs']
+            fran0_win_prob = self.acc['fran0_wins'][in_week] / runs
+        else:
+            if week not in self.week_wins:
+                self.week_wins[week] = self.simulate_week(week)
+            fran0_wins, runs = self.week_wins[week]
+            fran0_win_prob = fran0_wins / runs
+        names = np.array([self.fran_id_to_name[fran_id] for fran_id in self.fran_ids], dtype=object)
+        show_df = pd.DataFrame({'matchup': names[fran0] + ' vs. ' + names[fran1],
+                                'winner': np.where(fran0_win_prob >= 0.5, names[fran0], names[fran1]),
+                                'win_probability': np.maximum(fran0_win_prob, 1 - fran0_win_prob),
+                                'win_probability_se': self.std_error(fran0_win_prob, runs)})
+        return show_df.sort_values('matchup').reset_index(drop=True)
 
+    @profiled
+    def simulate_week(self, week):
+        '''
+        returns the head to head wins of franchise 0 in each matchup of a single week and the number of runs
+        in streaming mode the batches stop early on se_target and time_budget like the season does
+        '''
+        week_idx = np.flatnonzero(self.mu_week == week)
+        fran0_wins = np.zeros(len(week_idx), dtype=int)
+        runs = 0
+        if self.batch_size:
+            batches = ((self.dg.sample_pts(size, self.dg.shard_seed(batch)))
+                       for batch, size in self.batches(lambda: self.max_se(fran0_wins, runs)))
+        else:
+            batches = [None]
+        for pts_mat in batches:
+            week_pts = self.team_score_tensor([week], pts_mat)[:, 0, :]
+            fran0_wins += (week_pts[:, self.mu_fran0[week_idx]] > week_pts[:, self.mu_fran1[week_idx]]).sum(axis=0)
+            runs += week_pts.shape[0]
+        return fran0_wins, runs
 
+    @cached_property
+    def base_outcomes(self):
+        '''
+        the wins and playoff flags of every franchise in every run before any trade
+        '''
+        return self.standings['wins'], self.standings['made_playoffs'].astype(float)
+
+    @profiled
+    def run_outcomes(self, team_pts):
+        '''
+        returns two (runs x franchises) arrays, the wins and the playoff flag of every franchise in every run
+        '''
+        standings = self.qualify(team_pts)
+        return standings['wins'], standings['made_playoffs'].astype(float)
+
+    @profiled
+    def evaluate_trade(self, moves):
+        '''
+        returns the change in playoff odds and average wins of every franchise involved in a trade
+        moves is a list of (player_id, id_franchise) pairs sending each player to a new franchise
+        a single scenario of evaluate_scenarios
+        '''
+        sweep_df = self.evaluate_scenarios({'trade': {'moves': moves}})
+        trade_df = sweep_df[sweep_df.changed].set_index('id')
+        trade_df = trade_df[['made_playoffs', 'made_playoffs_scenario', 'made_playoffs_delta', 'made_playoffs_delta_se',
+                             'average_wins', 'average_wins_scenario', 'average_wins_delta']]
+        trade_df.columns = trade_df.columns.str.replace('_scenario', '_trade')
+        return self.show_fran_name(trade_df)
+
+    @profiled
+    def evaluate_scenarios(self, scenarios):
+        '''
+        returns the change in playoff odds and average wins of every franchise under each of many roster scenarios
+        scenarios maps a scenario name to a dict of roster changes, any of
+            moves: (player_id, id_franchise) pairs sending each player to a franchise, a pickup if unrostered
+            drops: player ids released by their franchise
+            injured: player ids scoring 0 the rest of the season, or a dict of player id to the weeks missed
+        every scenario reuses the same simulated player scores (common random numbers), the starters and
+        team totals of the franchises the scenarios change are recomputed together in one pass
+        returns one row per scenario and franchise, changed flags the franchises whose roster changed
+        '''
+        if self.batch_size:
+            raise ValueError('evaluate_scenarios needs the simulated draws, run without batch_size')
+        names = list(scenarios)
+        rosters = [self.scenario_roster(i, changes) for i, changes in enumerate(scenarios.values())]
+        # Each changed franchise of each scenario is its own column of the scenario team scores
+        key_scenario = np.array([i for i, (_, affected) in enumerate(rosters) for _ in affected], dtype=int)
+        key_fran = np.array([self.fran_ids.index(fran_id) for _, affected in rosters for fran_id in affected],
+                            dtype=int)
+        keys = [str(i) + ':' + self.fran_ids[j] for i, j in zip(key_scenario, key_fran)]
+        if keys:
+            scenario_df = pd.concat([roster_df for roster_df, _ in rosters]).drop(columns=['flex_rank'])
+            scenario_pts = self.team_score_tensor(self.sim_weeks, score_df=self.dg.pick_starters(scenario_df),
+                                                  fran_ids=keys)
+        base_wins, base_playoffs = self.base_outcomes
+        n_runs, n_fran = base_wins.shape
+        wins = np.empty((len(names), n_fran))
+        playoffs = np.empty((len(names), n_fran))
+        wins_se = np.empty((len(names), n_fran))
+        playoffs_se = np.empty((len(names), n_fran))
+        # Scenarios are qualified together, stacked on the runs axis, about 128MB of team scores at a time
+        chunk = max(1, 2 ** 24 // self.team_pts.size)
+        for start in range(0, len(names), chunk):
+            stop = min(start + chunk, len(names))
+            team_pts = np.repeat(self.team_pts[np.newaxis], stop - start, axis=0)
+            in_chunk = (key_scenario >= start) & (key_scenario < stop)
+            if in_chunk.any():
+                team_pts[key_scenario[in_chunk] - start, :, :, key_fran[in_chunk]] = \
+                    scenario_pts[:, :, in_chunk].transpose(2, 0, 1)
+            wins_diff, playoffs_diff = self.run_outcomes(team_pts.reshape(-1, *team_pts.shape[2:]))
+            wins_diff = wins_diff.reshape(stop - start, n_runs, n_fran) - base_wins
+            playoffs_diff = playoffs_diff.reshape(stop - start, n_runs, n_fran) - base_playoffs
+            wins[start:stop] = wins_diff.mean(axis=1)
+            playoffs[start:stop] = playoffs_diff.mean(axis=1)
+            wins_se[start:stop] = wins_diff.std(axis=1, ddof=1) / np.sqrt(n_runs)
+            playoffs_se[start:stop] = playoffs_diff.std(axis=1, ddof=1) / np.sqrt(n_runs)
+        changed = np.zeros((len(names), n_fran), dtype=bool)
+        changed[key_scenario, key_fran] = True
+        sweep_df = pd.DataFrame({'scenario': np.repeat(np.array(names, dtype=object), n_fran),
+                                 'id': np.tile(np.array(self.fran_ids, dtype=object), len(names)),
+                                 'changed': changed.ravel()})
+        sweep_df['franchise'] = sweep_df.id.map(self.fran_id_to_name)
+        sweep_df['made_playoffs'] = np.tile(base_playoffs.mean(axis=0), len(names))
+        sweep_df['made_playoffs_scenario'] = sweep_df.made_playoffs + playoffs.ravel()
+        sweep_df['made_playoffs_delta'] = playoffs.ravel()
+        sweep_df['made_playoffs_delta_se'] = playoffs_se.ravel()
+        sweep_df['average_wins'] = np.tile(base_wins.mean(axis=0), len(names))
+        sweep_df['average_wins_scenario'] = sweep_df.average_wins + wins.ravel()
+        sweep_df['average_wins_delta'] = wins.ravel()
+        sweep_df['average_wins_delta_se'] = wins_se.ravel()
+        return sweep_df
+
+    @profiled
+    def rank_free_agents(self, id_franchise, candidates=None, drop=True,
+                         sort_by=('made_playoffs_delta', 'average_wins_delta')):
+        '''
+        ranks the free agents by the change in playoff odds and average wins of a franchise picking them up
+        candidates defaults to every simulated free agent, the Data_Generator must be built with free_agents=True
+        with drop every rostered player is tried as the release for each candidate and the best one is kept
+        all pickup and drop pairs are evaluated together as one evaluate_scenarios sweep
+        '''
+        score_df = self.dg.score_df
+        fa_df = score_df[score_df.id_franchise.isna()]
+        if candidates is not None:
+            fa_df = fa_df[fa_df.player_id.isin(list(candidates))]
+        fa_pts = fa_df.groupby('player_id', sort=False).mean_pts.sum()
+        fa_pts = fa_pts[fa_pts > 0]
+        if len(fa_pts) == 0:
+            raise ValueError('No simulated free agents, build the Data_Generator with free_agents=True')
+        drops = [None]
+        if drop:
+            drops = list(score_df.loc[score_df.id_franchise == id_franchise, 'player_id'].unique())
+        pairs = list(product(fa_pts.index, drops))
+        scenarios = {i: {'moves': [(player_id, id_franchise)], 'drops': [] if drop_id is None else [drop_id]}
+                     for i, (player_id, drop_id) in enumerate(pairs)}
+        sweep_df = self.evaluate_scenarios(scenarios)
+        sweep_df = sweep_df[sweep_df.id == id_franchise].reset_index(drop=True)
+        sweep_df['player_id'] = [player_id for player_id, _ in pairs]
+        sweep_df['drop_id'] = [drop_id for _, drop_id in pairs]
+        # Best drop of every candidate
+        sweep_df = sweep_df.sort_values(list(sort_by), ascending=False).drop_duplicates('player_id')
+        players = score_df.drop_duplicates('player_id').set_index('player_id')
+        rank_df = pd.DataFrame({'player_id': sweep_df.player_id,
+                                'name_player': sweep_df.player_id.map(players.name_player),
+                                'position': sweep_df.player_id.map(players.position),
+                                'team': sweep_df.player_id.map(players.team),
+                                'season_pts': sweep_df.player_id.map(fa_pts),
+                                'drop_id': sweep_df.drop_id,
+                                'drop_name': sweep_df.drop_id.map(players.name_player)})
+        for col in ['made_playoffs', 'made_playoffs_scenario', 'made_playoffs_delta', 'made_playoffs_delta_se',
+                    'average_wins', 'average_wins_scenario', 'average_wins_delta', 'average_wins_delta_se']:
+            rank_df[col.replace('_scenario', '_pickup')] = sweep_df[col]
+        return rank_df.reset_index(drop=True)
+
+    def scenario_roster(self, scenario, changes):
+        '''
+        returns the score_df rows of the franchises a scenario changes, after the changes, and those franchises
+        id_franchise is prefixed with the scenario number so the rosters of every scenario can be stacked
+        '''
+        score_df = self.dg.score_df
+        moves = dict(changes.get('moves', []))
+        moves.update({player_id: None for player_id in changes.get('drops', [])})
+        injured = changes.get('injured', [])
+        if not isinstance(injured, dict):
+            injured = {player_id: self.sim_weeks for player_id in injured}
+        missing = (set(moves) | set(injured)) - set(score_df.player_id)
+        if missing:
+            raise ValueError('No simulated scores for players ' + ', '.join(sorted(missing)))
+        unknown = {fran_id for fran_id in moves.values() if fran_id is not None} - set(self.fran_ids)
+        if unknown:
+            raise ValueError('Unknown franchises ' + ', '.join(sorted(unknown)))
+        changed = score_df.player_id.isin(list(moves) + list(injured))
+        affected = set(moves.values()) | set(score_df.loc[changed, 'id_franchise'])
+        affected = [fran_id for fran_id in self.fran_ids if fran_id in affected]
+        roster_df = score_df[score_df.id_franchise.isin(affected) | score_df.player_id.isin(list(moves))].copy()
+        moved = roster_df.player_id.isin(list(moves))
+        roster_df.loc[moved, 'id_franchise'] = roster_df.loc[moved, 'player_id'].map(moves)
+        # Injured players are left out of the weeks they miss, so they neither start nor score
+        keep = roster_df.id_franchise.notna()
+        missed = [(player_id, week) for player_id, weeks in injured.items() for week in weeks]
+        if missed:
+            keep &= ~pd.MultiIndex.from_frame(roster_df[['player_id', 'week']]).isin(missed)
+        roster_df = roster_df[keep]
+        return roster_df.assign(id_franchise=str(scenario) + ':' + roster_df.id_franchise), affected
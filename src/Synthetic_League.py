@@ -0,0 +1,195 @@
+import gzip
+import json
+import string
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.API_Wrapper import API
+from src.Data_Generator import Data_Generator
+
+
+class Synthetic_League():
+    '''
+    Builds a random league of any size, the MFL responses of its API calls and the projection,
+    defensive and correlation inputs Data_Generator reads from the data folder
+    Used to run the simulation offline, without MFL or the season data files
+    '''
+
+    nfl_teams = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE', 'DAL', 'DEN', 'DET', 'GBP', 'HOU', 'IND',
+                 'JAC', 'KCC', 'LVR', 'LAC', 'LAR', 'MIA', 'MIN', 'NEP', 'NOS', 'NYG', 'NYJ', 'PHI', 'PIT', 'SFO',
+                 'SEA', 'TBB', 'TEN', 'WAS']
+    # Roster spots are filled in this order, then the order repeats
+    roster_template = ['QB', 'RB', 'RB', 'WR', 'WR', 'WR', 'TE', 'RB', 'WR', 'QB', 'TE', 'RB', 'WR', 'PK', 'Def',
+                       'RB']
+    # Season projection mean and spread by position
+    proj_dist = {'QB': (260, 60), 'RB': (150, 60), 'WR': (150, 60), 'TE': (90, 40)}
+
+    def __init__(self, franchises=12, roster_size=16, free_agents=0, week=1, seed=0, leagueid=1):
+        if franchises % 2:
+            raise ValueError('franchises must be even so every franchise plays every week')
+        self.franchises = franchises
+        self.roster_size = roster_size
+        self.free_agents = free_agents
+        self.week = week
+        self.seed = seed
+        self.leagueid = leagueid
+        self.rng = np.random.default_rng(seed)
+        self.fran_ids = ['%04d' % (i + 1) for i in range(franchises)]
+        self.players_df = self.create_players()
+        self.plr_proj_dict = self.create_projections()
+        self.pos_opp_dict = self.create_pos_opp_dict()
+        self.corr_df = self.create_corr_df()
+
+    def create_players(self):
+        '''
+        returns a dataframe of every player, rostered players have their id_franchise set
+        names are letters only so each one normalizes to a distinct projection key
+        '''
+        n_rostered = self.franchises * self.roster_size
+        n_players = n_rostered + self.free_agents
+        positions = [self.roster_template[i % len(self.roster_template)] for i in range(self.roster_size)]
+        fa_positions = list(self.proj_dist)
+        positions = positions * self.franchises + \
+            [fa_positions[i % len(fa_positions)] for i in range(self.free_agents)]
+        players_df = pd.DataFrame({'id': [str(10000 + i) for i in range(n_players)],
+                                   'name': ['Synthetic, ' + self.letters(i) for i in range(n_players)],
+                                   'position': positions,
+                                   'team': self.rng.choice(self.nfl_teams, n_players)})
+        players_df['id_franchise'] = [self.fran_ids[i // self.roster_size] for i in range(n_rostered)] + \
+            [None] * self.free_agents
+        return players_df
+
+    def letters(self, i):
+        '''
+        spells a number with three letters, Aaa, Aab, ...
+        '''
+        word = ''
+        for _ in range(3):
+            i, rem = divmod(i, 26)
+            word = string.ascii_lowercase[rem] + word
+        return word.capitalize()
+
+    def create_projections(self):
+        '''
+        returns the season projection of every QB, RB, WR and TE keyed like Data_Generator.plr_proj_dict
+        '''
+        proj_df = self.players_df[self.players_df.position.isin(list(self.proj_dist))]
+        mean = proj_df.position.map({pos: dist[0] for pos, dist in self.proj_dist.items()}).to_numpy()
+        sd = proj_df.position.map({pos: dist[1] for pos, dist in self.proj_dist.items()}).to_numpy()
+        fpts = np.maximum(self.rng.normal(mean, sd), 0).round(1)
+        keys = proj_df.name.str.split(', ').str[::-1].str.join('').str.lower()
+        return dict(zip(keys, fpts))
+
+    def create_pos_opp_dict(self):
+        '''
+        returns random opponent-position factors keyed like Data_Generator.pos_opp_dict
+        '''
+        return {pos: {**{team: {'PPG': factor} for team, factor in
+                         zip(self.nfl_teams, self.rng.normal(1, 0.1, len(self.nfl_teams)))},
+                      'BYE': {'PPG': 0}}
+                for pos in self.proj_dist}
+
+    def create_corr_df(self):
+        '''
+        returns a random positive definite correlation matrix of the 14 position slots of a game
+        '''
+        slots = ['QB1', 'RB1', 'RB2', 'WR1', 'WR2', 'WR3', 'TE1']
+        slots = slots + ['OPP_' + slot for slot in slots]
+        factor = self.rng.normal(0, 0.4, (len(slots), 3))
+        cov = factor @ factor.T + np.eye(len(slots))
+        sd = np.sqrt(np.diag(cov))
+        return pd.DataFrame(cov / np.outer(sd, sd), index=slots, columns=slots)
+
+    def responses(self):
+        '''
+        returns the MFL responses of the calls a simulation makes, keyed by their request parameters
+        '''
+        rostered = self.players_df[self.players_df.id_franchise.notna()]
+        player_cols = ['id', 'name', 'position', 'team']
+        rosters = {'rosters': {'franchise': [
+            {'id': fran_id, 'week': str(self.week),
+             'player': [{'id': player_id, 'status': 'ROSTER'}
+                        for player_id in rostered.loc[rostered.id_franchise == fran_id, 'id']]}
+            for fran_id in self.fran_ids]}}
+        league = {'league': {'franchises': {'franchise': [
+            {'id': fran_id, 'name': 'Franchise ' + fran_id, 'division': '%02d' % (i % 4)}
+            for i, fran_id in enumerate(self.fran_ids)]}}}
+        free_agents = self.players_df[self.players_df.id_franchise.isna()]
+        free_agent_list = {'freeAgents': {'leagueUnit': {'unit': 'LEAGUE', 'player': [
+            {'id': player_id, 'status': 'FA'} for player_id in free_agents.id]}}}
+        return [(dict(TYPE='rosters', L=self.leagueid), rosters),
+                (dict(TYPE='league', L=self.leagueid), league),
+                (dict(TYPE='schedule', L=self.leagueid), self.league_schedule()),
+                (dict(TYPE='nflSchedule', W=''), self.nfl_schedule()),
+                (dict(TYPE='players', L=self.leagueid, PLAYERS=','.join(rostered.id)),
+                 {'players': {'player': rostered[player_cols].to_dict(orient='records')}}),
+                (dict(TYPE='freeAgents', L=self.leagueid), free_agent_list),
+                (dict(TYPE='players', L=self.leagueid, PLAYERS=','.join(free_agents.id)),
+                 {'players': {'player': free_agents[player_cols].to_dict(orient='records')}})]
+
+    def league_schedule(self):
+        '''
+        returns 17 weeks of random fantasy matchups in the MFL schedule format
+        '''
+        weeks = []
+        for week in range(1, 18):
+            order = self.rng.permutation(self.fran_ids)
+            weeks.append({'week': str(week),
+                          'matchup': [{'franchise': [{'id': order[i]}, {'id': order[i + 1]}]}
+                                      for i in range(0, len(order), 2)]})
+        return {'schedule': {'weeklySchedule': weeks}}
+
+    def nfl_schedule(self):
+        '''
+        returns 18 weeks of random NFL games in the MFL format, two teams are on bye in weeks 5 to 14
+        '''
+        weeks = []
+        for week in range(1, 19):
+            order = self.rng.permutation(self.nfl_teams)
+            if 5 <= week <= 14:
+                order = order[2:]
+            weeks.append({'matchup': [{'team': [{'id': order[i]}, {'id': order[i + 1]}]}
+                                      for i in range(0, len(order), 2)]})
+        return {'fullNflSchedule': {'nflSchedule': weeks}}
+
+    def save_snapshot(self, path):
+        '''
+        writes the league responses to an API snapshot bundle at path
+        '''
+        api = API(self.leagueid)
+        bundle = {'version': API.SNAPSHOT_VERSION,
+                  'created': datetime.now().isoformat(),
+                  'leagueid': self.leagueid,
+                  'year': api.year,
+                  'responses': {api._request_key(dict(params, JSON=1)): response
+                                for params, response in self.responses()}}
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(bundle, f)
+
+    def api(self, path):
+        '''
+        saves the league snapshot to path and returns an API replaying it
+        '''
+        self.save_snapshot(path)
+        return API(self.leagueid, replay=path)
+
+
+class Synthetic_Data_Generator(Data_Generator):
+    '''
+    Data_Generator reading its projection, defensive and correlation inputs from a Synthetic_League
+    '''
+
+    def __init__(self, league, *args, **kwargs):
+        self.league = league
+        kwargs.setdefault('cache_dir', None)
+        kwargs.setdefault('index_path', None)
+        super().__init__(*args, **kwargs)
+
+    def create_plr_proj_dict(self):
+        return self.league.plr_proj_dict
+
+    def create_pos_opp_dict(self):
+        return self.league.pos_opp_dict
+
+    def read_corr_df(self):
+        return self.league.corr_df
@@ -83,6 +83,7 @@ week = 1
 n = 100
 # Instatiate Classes
 api = API(leagueid=LEAGUE_ID, user_agent=USER_AGENT)
+api.prefetch()
 rep = Reporter(api, week)
 dg = Data_Generator(week, api, rep, n)
 sim = Simulator(week, api, rep, dg, n)